@@ -18,8 +18,19 @@ from unicorn import *
 from unicorn.arm_const import *
 
 import argparse
+import copy
+import hashlib
+import json
+import multiprocessing
+import pickle
+import sqlite3
 import struct
 import os
+import sys
+import tempfile
+import time
+from array import array
+import numpy as np
 
 AVD_CM3_CMD_SIZE     = 0x60
 AVD_CM3_CMD_INIT     = 0x0
@@ -29,6 +40,7 @@ AVD_CM3_CMD_ABORT    = 0x2
 AVD_CM3_MODE_H265    = 0x0  # 265 before 264, interesting
 AVD_CM3_MODE_H264    = 0x1
 AVD_CM3_MODE_VP9     = 0x2
+AVD_CM3_MODE_NAMES   = {AVD_CM3_MODE_H265: "h265", AVD_CM3_MODE_H264: "h264", AVD_CM3_MODE_VP9: "vp9"}
 
 AVD_CM3_SRAM_ADDR    = 0x108c000  # Physical offset
 AVD_CM3_SRAM_SIZE    = 0x10000
@@ -40,6 +52,21 @@ AVD_CM3_FIFO_COUNT   = 4   # CM3 SRAM queue
 AVD_CM3_FIFO_WIDTH   = 0xe68
 AVD_DART1_FIFO_COUNT = 16  # DART1/GART queue
 AVD_DART1_FIFO_WIDTH = 0xb8000
+AVD_DART_PAGE_SHIFT  = 14  # 16K pages
+
+AVD_EMU_VERSION      = 1   # bump when a handler change alters the inst stream
+
+AVD_TRACE_DTYPE = np.dtype([("cmd", "<u4"), ("pc", "<u4"), ("addr", "<u4"), ("val", "<u4"),
+			("size", "u1"), ("write", "u1")])
+
+# Registers the instruction stream depends on; --fast hooks only these
+AVD_CM3_FAST_MMIO = [
+	(0x40070004, 0x40070058),  # PIODMA status/addr/command
+	(0x40104004, 0x40104064),  # Inst FIFOs, decode command/status
+	(0x50010010, 0x5001002c),  # cm3ctrl IRQ enables
+	(0x50010050, 0x50010060),  # Mailbox
+	(0xe000e100, 0xe000e120),  # NVIC ISEN (write-1-to-set)
+]
 
 def is_pow2(x): return (x != 0) and (x & (x - 1) == 0)
 def round_up(x, y): return ((x + (y - 1)) & (-y))
@@ -95,9 +122,208 @@ def bitrepr(size, bits):
 
 def bitrepr32(x): return bitrepr(4, struct.pack("<I", x))
 
+def get_params_mode(frame_params):
+	# PIODMA header sanity check; returns the AVD_CM3_MODE_* it carries
+	header = struct.unpack("<%dI" % (0x10), frame_params[:0x40])
+	assert(header[5] == 0xdeadcafe) # sanity check
+	if (header[1] not in (AVD_CM3_MODE_H265, AVD_CM3_MODE_H264, AVD_CM3_MODE_VP9)):
+		raise ValueError("unsupported codec (%d) or corrupted packet" % (header[1]))
+	return header[1]
+
+class AVDDartSpace:
+	# Sparse IOVA space: buffers are mapped in place at their IOVA and looked
+	# up by page, so nothing is padded or copied until a PIODMA transfer
+	def __init__(self):
+		self.maps = {}   # iova -> memoryview
+		self.pages = {}  # page -> iova of the mapping covering it
+
+	def map(self, iova, buf):
+		assert(not (iova & ((1 << AVD_DART_PAGE_SHIFT) - 1)))
+		self.unmap(iova)
+		self.maps[iova] = memoryview(buf)
+		end = iova + max(len(buf), 1)
+		for page in range(iova >> AVD_DART_PAGE_SHIFT, ((end - 1) >> AVD_DART_PAGE_SHIFT) + 1):
+			old = self.pages.get(page)
+			if (old is not None and old != iova):
+				self.unmap(old)
+			self.pages[page] = iova
+
+	def unmap(self, iova):
+		buf = self.maps.pop(iova, None)
+		if (buf is None): return
+		self.pages = {page: base for page, base in self.pages.items() if base != iova}
+
+	def read(self, iova, size):
+		base = self.pages.get(iova >> AVD_DART_PAGE_SHIFT)
+		if (base is None):
+			return b"\00" * size  # unmapped reads as zero
+		off = iova - base
+		return self.maps[base][off:off+size]
+
+class AVDTraceRing:
+	# Preallocated ring of AVD_TRACE_DTYPE records; oldest get overwritten
+	def __init__(self, size=1 << 20):
+		self.buf = np.zeros(size, dtype=AVD_TRACE_DTYPE)
+		self.pos = 0  # records appended so far
+
+	def append(self, cmd, pc, addr, val, size, write):
+		self.buf[self.pos % len(self.buf)] = (cmd, pc, addr, val, size, write)
+		self.pos += 1
+
+	def records(self):
+		n = len(self.buf)
+		if (self.pos <= n):
+			return self.buf[:self.pos]
+		i = self.pos % n
+		return np.concatenate((self.buf[i:], self.buf[:i]))
+
+	def save(self, path):
+		np.save(path, self.records())
+
+	@staticmethod
+	def load(path):
+		return np.load(path)
+
+def thumb_block_insts(buf):
+	# Thumb-2: halfwords starting 0b11101/0b11110/0b11111 are 32-bit
+	hw = struct.unpack("<%dH" % (len(buf) // 2), buf[:len(buf) & ~1])
+	n, i = 0, 0
+	while (i < len(hw)):
+		i += 2 if ((hw[i] >> 11) >= 0x1d) else 1
+		n += 1
+	return n
+
+class AVDFirmwareProfile:
+	# Call tree as parallel node arrays; node 0 is the command's IRQ entry
+	def __init__(self, entry):
+		self.commands = 0
+		self.node_func = [entry]
+		self.node_parent = [-1]
+		self.children = {}  # (parent, func) -> node
+		self.node_insts = np.zeros(64, dtype=np.uint64)
+		self.node_calls = np.zeros(64, dtype=np.uint64)
+		self.block_counts = np.zeros(0x10000 >> 1, dtype=np.uint64)  # per halfword
+
+	def get_child(self, node, func):
+		child = self.children.get((node, func))
+		if (child is None):
+			child = len(self.node_func)
+			self.children[(node, func)] = child
+			self.node_func.append(func)
+			self.node_parent.append(node)
+			if (child >= len(self.node_insts)):
+				self.node_insts = np.concatenate((self.node_insts, np.zeros_like(self.node_insts)))
+				self.node_calls = np.concatenate((self.node_calls, np.zeros_like(self.node_calls)))
+		return child
+
+class AVDFirmwareProfiler:
+	# Counts executed instructions per basic block and per function from a
+	# block hook. A block entered with LR pointing right past the previous
+	# block ended in a call; the shadow stack pops when execution comes back
+	# to the return address at the caller's SP.
+	def __init__(self, firmware):
+		self.names = {}
+		for n in range(min(len(firmware) // 4, 16 + 64)):  # vector table
+			vec = struct.unpack("<I", firmware[n*4:n*4+4])[0]
+			if ((n > 0) and (vec & 1) and (vec < len(firmware))):
+				self.names.setdefault(vec & ~1, "vec_%d" % (n))
+		self.profiles = {}
+		self.prof = None
+		self.block_insts = {}
+
+	def get_name(self, addr):
+		return self.names.get(addr, "sub_%x" % (addr))
+
+	def begin(self, key, entry, sp):
+		prof = self.profiles.get(key)
+		if (prof is None):
+			prof = AVDFirmwareProfile(entry)
+			self.profiles[key] = prof
+		prof.commands += 1
+		prof.node_calls[0] += 1
+		self.prof = prof
+		self.stack = [(0, None, sp)]  # (node, return addr, sp at call)
+		self.prev_end = None
+
+	def end(self):
+		self.prof = None
+
+	def hook_block(self, emu, addr, size, data):
+		prof = self.prof
+		if (prof is None): return
+		n = self.block_insts.get(addr)
+		if (n is None):
+			n = thumb_block_insts(emu.mem_read(addr, size))
+			self.block_insts[addr] = n
+
+		stack = self.stack
+		sp = emu.reg_read(UC_ARM_REG_SP)
+		while (len(stack) > 1 and ((addr == stack[-1][1] and sp >= stack[-1][2]) or sp > stack[-1][2])):
+			stack.pop()
+		lr = emu.reg_read(UC_ARM_REG_LR) & ~1
+		if (lr == self.prev_end):
+			node = prof.get_child(stack[-1][0], addr)
+			prof.node_calls[node] += 1
+			stack.append((node, lr, sp))
+		self.prev_end = addr + size
+
+		prof.node_insts[stack[-1][0]] += n
+		prof.block_counts[(addr & 0xffff) >> 1] += 1
+
+	def get_tree(self, prof, node=0):
+		kids = [self.get_tree(prof, child) for (parent, func), child in prof.children.items() if parent == node]
+		kids.sort(key=lambda x: -x["total"])
+		insts = int(prof.node_insts[node])
+		return {"func": self.get_name(prof.node_func[node]), "addr": prof.node_func[node],
+			"calls": int(prof.node_calls[node]), "self": insts,
+			"total": insts + sum([x["total"] for x in kids]), "children": kids}
+
+	def get_flat(self, prof):
+		num = len(prof.node_func)
+		funcs = np.array(prof.node_func, dtype=np.int64)
+		parent = np.array(prof.node_parent, dtype=np.int64)
+		insts = prof.node_insts[:num].astype(np.int64)
+		# children always come after their parent, so one reverse pass sums subtrees
+		total = insts.copy()
+		for node in range(num - 1, 0, -1):
+			total[parent[node]] += total[node]
+		# don't double count recursion: only the outermost frame of a func is inclusive
+		outer = np.ones(num, dtype=bool)
+		for node in range(1, num):
+			p = parent[node]
+			while (p >= 0):
+				if (funcs[p] == funcs[node]):
+					outer[node] = False
+					break
+				p = parent[p]
+		flat = []
+		for func in np.unique(funcs):
+			m = funcs == func
+			flat.append({"func": self.get_name(int(func)), "addr": int(func),
+				"calls": int(prof.node_calls[:num][m].sum()), "self": int(insts[m].sum()),
+				"total": int(total[m & outer].sum())})
+		flat.sort(key=lambda x: -x["self"])
+		return flat
+
+	def report(self):
+		out = {}
+		for key, prof in self.profiles.items():
+			blocks = np.flatnonzero(prof.block_counts)
+			out[key] = {"commands": prof.commands,
+				"insts": int(prof.node_insts.sum()),
+				"flat": self.get_flat(prof),
+				"tree": self.get_tree(prof),
+				"blocks": {"%x" % (x << 1): int(prof.block_counts[x]) for x in blocks}}
+		return out
+
+	def save(self, path):
+		with open(path, "w") as f:
+			json.dump(self.report(), f, indent=1)
+
 class AVDEmulator:
 	def __init__(self, firmware, trace_sram=False, format_mmio=False, verbose=False,
-			trace_code=False, stfu=False, inst_only=False, show_bits=False, **kwargs):
+			trace_code=False, stfu=False, inst_only=False, show_bits=False, fast=False,
+			count_insts=False, profile=False, ring="", ring_size=1 << 20, sram_deltas=False, tracer=None, **kwargs):
 		self.firmware = open(firmware, 'rb').read()
 		self.trace_sram = trace_sram
 		self.format_mmio = format_mmio
@@ -106,6 +332,17 @@ class AVDEmulator:
 		self.stfu = stfu
 		self.inst_only = inst_only
 		self.show_bits = show_bits
+		self.fast = fast
+		self.count_insts = count_insts
+		self.profiler = AVDFirmwareProfiler(self.firmware) if profile else None
+		self.ring_sram = ring in ["sram", "all"]
+		self.ring_mmio = ring in ["mmio", "all"]
+		self.ring = AVDTraceRing(ring_size) if ring else None
+		self.cmd_seq = 0
+		self.capture_sram = sram_deltas
+		self.sram_deltas = []
+		self.tracer = tracer  # avid.trace.AVDTracer, one span per command
+		self.frame_paths = []
 		if (self.inst_only):
 			self.stfu = True
 
@@ -114,6 +351,8 @@ class AVDEmulator:
 		emu.mem_write(0x00000000, self.firmware)
 		self.emu = emu
 		self.mmio_map = {}
+		self.mmio_rtab = {}
+		self.mmio_wtab = {}
 
 		self.cm3ctrl_enabled_irq0 = 0
 		self.cm3ctrl_enabled_irqs = [0] * 6
@@ -122,11 +361,31 @@ class AVDEmulator:
 		self.piodma_iova_high = 0x00000000
 
 		self.fifo1_idx = 0
-		self.dart1_space = b''
+		self.dart1_space = AVDDartSpace()
 		self.cmd_idx = 0
+		self.cmd_queue = []
 		self.inst_stream = []
+		self.inst_streams = []
+		self.doorbell_count = 0
+		self.status_poll_count = 0
+		self.stop_reason = None
+		self.inst_count = 0
+		self.block_insts = {}
+		self.cmd_stats = []
 		self.hl_color = 37
 		self.mode = 0
+		self.boot_snap = None
+
+	# Python-side device state that has to travel with the Unicorn state
+	SNAPSHOT_ATTRS = ["cm3ctrl_enabled_irq0", "cm3ctrl_enabled_irqs", "nvic_enabled_irqs",
+			"piodma_iova_low", "piodma_iova_high", "cmd_idx", "status_val"]
+
+	# UcContext holds host pointers and can't be restored into another Uc,
+	# so on-disk snapshots carry plain register values (CONTROL before SP)
+	SNAPSHOT_REGS = [UC_ARM_REG_CONTROL, UC_ARM_REG_MSP, UC_ARM_REG_PSP] + \
+			[UC_ARM_REG_R0 + i for i in range(13)] + \
+			[UC_ARM_REG_SP, UC_ARM_REG_LR, UC_ARM_REG_PC, UC_ARM_REG_XPSR,
+			UC_ARM_REG_PRIMASK, UC_ARM_REG_BASEPRI, UC_ARM_REG_FAULTMASK]
 
 	def log(self, x, f=print):
 		if (not self.stfu): return f(f'[EMU] {x}')
@@ -141,11 +400,10 @@ class AVDEmulator:
 		assert((fifo1_idx >= 0) and (fifo1_idx <= AVD_DART1_FIFO_COUNT))
 		self.fifo1_idx = fifo1_idx
 
-		# Pad DART1 space for easy piodma indexing
-		# TODO might just fix PIODMA handler to not waste memory
+		# Map at the slot's IOVA; other slots stay resident
 		fifo1_iova = 0x4000 + (AVD_DART1_FIFO_WIDTH * self.fifo1_idx)
 		self.log("setting frame params @ iova 0x%x n=%d" % (fifo1_iova, fifo1_idx))
-		self.dart1_space = b"\00"*fifo1_iova + frame_params
+		self.dart1_space.map(fifo1_iova, frame_params)
 		return fifo1_idx
 
 	def set_params_h265(self, frame_params):
@@ -249,34 +507,33 @@ class AVDEmulator:
 		cmd[18] = 0x0
 		return struct.pack("<" + "I"*(len(cmd)), *cmd)
 
-	def set_params(self, frame_path):
+	def set_params(self, frame_path, frame_params=None):
 		self.log("reading frame params from %s" % (frame_path))
-		frame_params = open(frame_path, "rb").read()
+		self.frame_paths.append(frame_path)
+		if (frame_params is None):
+			frame_params = open(frame_path, "rb").read()
 		if (not self.stfu):
 			xxde(frame_params[:0x40], print_fn=self.log)
-		header = struct.unpack("<%dI" % (0x10), frame_params[:0x40])
-		assert(header[5] == 0xdeadcafe) # sanity check
+		mode = get_params_mode(frame_params)
 
-		if   (header[1] == AVD_CM3_MODE_H265):
+		if   (mode == AVD_CM3_MODE_H265):
 			self.mode = AVD_CM3_MODE_H265
 			self.hl_color = 35  # purple
 			self.log(f"Mode: {self.hl('H265')}")
 			return self.set_params_h265(frame_params)
 
-		elif (header[1] == AVD_CM3_MODE_H264):
+		elif (mode == AVD_CM3_MODE_H264):
 			self.mode = AVD_CM3_MODE_H264
 			self.hl_color = 34  # blue
 			self.log(f"Mode: {self.hl('H264')}")
 			return self.set_params_h264(frame_params)
 
-		elif (header[1] == AVD_CM3_MODE_VP9):
+		else:
 			self.mode = AVD_CM3_MODE_VP9
 			self.hl_color = 32  # green
 			self.log(f"Mode: {self.hl('VP9')}")
 			return self.set_params_vp9(frame_params)
 
-		raise ValueError("unsupported codec (%d) or corrupted packet" % (header[1]))
-
 	def get_cmd_addr(self, cmd_idx): return 0x108eb30 + (cmd_idx * AVD_CM3_CMD_SIZE)
 
 	def start(self):
@@ -292,11 +549,62 @@ class AVDEmulator:
 			self.dump_regs()
 			self.dump_firmware_logs()
 
+	def snapshot(self):
+		emu = self.emu
+		return {
+			"firmware": hashlib.sha1(self.firmware).hexdigest(),
+			"ctx": emu.context_save(),
+			"regs": [(reg, emu.reg_read(reg)) for reg in self.SNAPSHOT_REGS],
+			"mem": [(begin, bytes(emu.mem_read(begin, end - begin + 1))) for (begin, end, perms) in emu.mem_regions()],
+			"attrs": {name: copy.deepcopy(getattr(self, name)) for name in self.SNAPSHOT_ATTRS},
+		}
+
+	def restore(self, snap):
+		emu = self.emu
+		for (begin, buf) in snap["mem"]:
+			emu.mem_write(begin, buf)
+		if ("ctx" in snap):
+			emu.context_restore(snap["ctx"])
+		else:
+			for (reg, val) in snap["regs"]:
+				emu.reg_write(reg, val)
+			snap["ctx"] = emu.context_save()
+		for name, val in snap["attrs"].items():
+			setattr(self, name, copy.deepcopy(val))
+
+	def save_snapshot(self, path, snap=None):
+		snap = snap if snap is not None else self.snapshot()
+		with open(path, "wb") as f:
+			pickle.dump({k: v for k, v in snap.items() if k != "ctx"}, f)
+
+	def load_snapshot(self, path):
+		with open(path, "rb") as f:
+			snap = pickle.load(f)
+		if (snap["firmware"] != hashlib.sha1(self.firmware).hexdigest()):
+			raise ValueError("snapshot %s is from a different firmware" % (path))
+		return snap
+
+	def boot(self, path=None):
+		# Boot + INIT once, then every decode restores from here instead
+		if (path and os.path.exists(path)):
+			self.map_mmio()
+			self.set_mmio_map()
+			self.boot_snap = self.load_snapshot(path)
+			self.log(f"restored boot snapshot from {path}")
+		else:
+			self.start()
+			self.avd_cm3_cmd_init()
+			self.boot_snap = self.snapshot()
+			if (path):
+				self.save_snapshot(path, self.boot_snap)
+		self.restore(self.boot_snap)
+
 	def trigger_irq(self, irq_handler):
 		emu = self.emu
 		self.log(f"triggering IRQ @ {irq_handler:08x}")
 		emu.reg_write(UC_ARM_REG_LR, AVD_CM3_HACK_WFI_ADDRESS + 1)
 		emu.reg_write(UC_ARM_REG_PC, irq_handler)
+		self.stop_reason = None
 		emu.emu_start(irq_handler, 0)
 
 	def dump_regs(self):
@@ -329,6 +637,23 @@ class AVDEmulator:
 	def dump_sram(self, fname="sram.bin"):
 		open(fname, "wb").write(self.emu.mem_read(AVD_CM3_SRAM_BASE, AVD_CM3_SRAM_SIZE))
 
+	def read_sram32(self):
+		return np.frombuffer(self.emu.mem_read(AVD_CM3_SRAM_BASE, AVD_CM3_SRAM_SIZE), dtype="<u4")
+
+	def save_sram_deltas(self, path):
+		# Flattened (offset, old, new) words plus a per-command start index
+		deltas = self.sram_deltas
+		lens = [len(x["off"]) for x in deltas]
+		np.savez(path,
+			cmd=np.array([x["cmd"] for x in deltas], dtype=np.uint32),
+			opcode=np.array([x["opcode"] for x in deltas], dtype=np.uint8),
+			mode=np.array([x["mode"] for x in deltas], dtype=np.uint8),
+			paths=np.array([";".join(x["paths"]) for x in deltas]),
+			start=np.concatenate(([0], np.cumsum(lens))).astype(np.uint32),
+			off=np.concatenate([x["off"] for x in deltas] + [np.zeros(0, dtype=np.uint32)]),
+			old=np.concatenate([x["old"] for x in deltas] + [np.zeros(0, dtype=np.uint32)]),
+			new=np.concatenate([x["new"] for x in deltas] + [np.zeros(0, dtype=np.uint32)]))
+
 	def hook_code(self, emu, addr, size, data):
 		if (self.trace_code):
 			instruction = emu.mem_read(addr, size)
@@ -339,6 +664,12 @@ class AVDEmulator:
 				self.dump_regs()
 
 	def hook_mmio(self, emu, access, addr, size, val, data):
+		if (self.ring_mmio):
+			self.hook_mmio_fast(emu, access, addr, size, val, data)
+			if (access == UC_MEM_READ):
+				val = int.from_bytes(emu.mem_read(addr, size), "little")
+			self.ring.append(self.cmd_seq, emu.reg_read(UC_ARM_REG_PC), addr, val, size, access == UC_MEM_WRITE)
+			return
 		if addr in self.mmio_map:
 			if access == UC_MEM_READ:
 				read_fn = self.mmio_map[addr][0]
@@ -362,16 +693,38 @@ class AVDEmulator:
 			else:
 				self.log("%04x: %s: W%d @ %08x val 0x%x" % (pc, self.hl("MMIO"), size*8, addr, val))
 
-		prefix = "r" if access == UC_MEM_READ else "w"
-		name = "%s_%x" % (prefix, addr)
-		f = getattr(self, name, None)
-		if callable(f):
+		f = (self.mmio_rtab if access == UC_MEM_READ else self.mmio_wtab).get(addr)
+		if (f is not None):
 			if (access == UC_MEM_READ):
 				emu.mem_write(addr, struct.pack("<I", f(addr)))
 			elif (access == UC_MEM_WRITE):
 				f(addr, val)
 			return
 
+	def hook_wfi(self, emu, addr, size, data):
+		# Handler returned to the idle loop: command is done
+		self.stop_reason = "wfi"
+		emu.emu_stop()
+
+	def hook_block(self, emu, addr, size, data):
+		n = self.block_insts.get(addr)
+		if (n is None):
+			n = thumb_block_insts(emu.mem_read(addr, size))
+			self.block_insts[addr] = n
+		self.inst_count += n
+
+	def hook_mmio_fast(self, emu, access, addr, size, val, data):
+		if (access == UC_MEM_WRITE):
+			f = self.mmio_wtab.get(addr)
+			if (f is not None):
+				f(addr, val)
+			return
+		f = self.mmio_rtab.get(addr)
+		if (f is not None):
+			out_val = f(addr)
+			if (out_val is not None):
+				emu.mem_write(addr, struct.pack("<I", out_val))
+
 	def hook_sram(self, emu, access, addr, size, val, data):
 		pc = emu.reg_read(UC_ARM_REG_PC)
 		if (access == UC_MEM_READ):
@@ -380,12 +733,19 @@ class AVDEmulator:
 			self.log(f"{pc:04x}: SRAM: W{str(size*8).ljust(2)} @ {addr:08x} val 0x{val:x}")
 		if (self.verbose): self.dump_regs()
 
+	def hook_sram_ring(self, emu, access, addr, size, val, data):
+		if (access == UC_MEM_READ):
+			val = int.from_bytes(emu.mem_read(addr, size), "little")
+		self.ring.append(self.cmd_seq, emu.reg_read(UC_ARM_REG_PC), addr, val, size, access == UC_MEM_WRITE)
+
 	def map_mmio(self):
 		emu = self.emu
 		emu.mem_map(AVD_CM3_SRAM_BASE, AVD_CM3_SRAM_SIZE)
 		if (self.trace_sram):
 			emu.hook_add(UC_HOOK_MEM_READ, self.hook_sram, begin=AVD_CM3_SRAM_BASE, end=AVD_CM3_SRAM_BASE + AVD_CM3_SRAM_SIZE)
 			emu.hook_add(UC_HOOK_MEM_WRITE, self.hook_sram, begin=AVD_CM3_SRAM_BASE, end=AVD_CM3_SRAM_BASE + AVD_CM3_SRAM_SIZE)
+		if (self.ring_sram):
+			emu.hook_add(UC_HOOK_MEM_READ | UC_HOOK_MEM_WRITE, self.hook_sram_ring, begin=AVD_CM3_SRAM_BASE, end=AVD_CM3_SRAM_BASE + AVD_CM3_SRAM_SIZE - 1)
 
 		MMIO_BLOCKS = [
 			(0x40070000, 0x4000),  # PIODMA
@@ -396,9 +756,22 @@ class AVDEmulator:
 		]
 		for (addr, size) in MMIO_BLOCKS:
 			emu.mem_map(addr, size)
+			if (self.fast and not self.ring_mmio): continue  # ring tracing needs the catch-all hook
 			emu.hook_add(UC_HOOK_MEM_READ, self.hook_mmio, begin=addr, end=addr+size)
 			emu.hook_add(UC_HOOK_MEM_WRITE, self.hook_mmio, begin=addr, end=addr+size)
-		emu.hook_add(UC_HOOK_CODE, self.hook_code, begin=0x00000000, end=0xffffffff)
+		if (self.fast and not self.ring_mmio):
+			# Everything else is plain memory. Registers whose handlers keep
+			# state (ISEN reads back the accumulated set bits, not the last
+			# write) have to stay hooked
+			for (start, end) in AVD_CM3_FAST_MMIO:
+				emu.hook_add(UC_HOOK_MEM_READ | UC_HOOK_MEM_WRITE, self.hook_mmio_fast, begin=start, end=end - 1)
+		if (self.trace_code):
+			emu.hook_add(UC_HOOK_CODE, self.hook_code, begin=0x00000000, end=0xffffffff)
+		if (self.count_insts):
+			emu.hook_add(UC_HOOK_BLOCK, self.hook_block, begin=0x00000000, end=0xffff)
+		if (self.profiler):
+			emu.hook_add(UC_HOOK_BLOCK, self.profiler.hook_block, begin=0x00000000, end=0xffff)
+		emu.hook_add(UC_HOOK_CODE, self.hook_wfi, begin=AVD_CM3_HACK_WFI_ADDRESS, end=AVD_CM3_HACK_WFI_ADDRESS)
 
 	def r_40070004(self, addr): # 0x40070004: PIODMA_STATUS
 		return 0x1 # Fake status to be done instantly, set no other bits
@@ -419,7 +792,7 @@ class AVDEmulator:
 		piodma_iova = self.piodma_iova_high << 32 | self.piodma_iova_low
 		# Peek ahead because we are not DMA controller
 		word_size = 0x4
-		word = struct.unpack("<I", self.dart1_space[piodma_iova:piodma_iova+word_size])[0]
+		word = struct.unpack("<I", self.dart1_space.read(piodma_iova, word_size))[0]
 		self.log("PIODMA: src iova: 0x%x cmd: 0x%x word: 0x%x" % (piodma_iova, val, word))
 
 		x = word & ~0x3fd0001
@@ -427,7 +800,7 @@ class AVDEmulator:
 
 		size = (val << 2) >> 8
 		self.log(f"PIODMA: transfer size {hex(size)} to cm3 dst {hex(dst_addr)}")
-		buf = self.dart1_space[piodma_iova+word_size:piodma_iova+size]
+		buf = bytes(self.dart1_space.read(piodma_iova+word_size, size-word_size))
 		self.avd_write(dst_addr, buf)
 		if (not self.stfu):
 			xxde(buf[:0x40], print_fn=self.log)
@@ -463,7 +836,10 @@ class AVDEmulator:
 
 	def r_40104060(self, addr): # 0x40104060: decode status
 		self.status_poll_count += 1
-		if (self.status_poll_count >= 5): raise ValueError("STFU")
+		if (self.status_poll_count >= 5):
+			# Firmware is spinning on a hw decode we don't model, bail out
+			self.stop_reason = "status"
+			self.emu.emu_stop()
 		return self.status_val
 
 	def w_40104060(self, addr, val):
@@ -514,6 +890,11 @@ class AVDEmulator:
 		return self.cm3ctrl_enabled_irqs[reg_idx]
 
 	def r_50010058(self, addr): # 0x50010058: read_cm3ctrl_mbox0_retrieve
+		if (self.cmd_queue):
+			# Batched: hand out the next queued slot, new inst stream per command
+			self.cmd_idx = self.cmd_queue.pop(0)
+			self.inst_stream = []
+			self.inst_streams.append(self.inst_stream)
 		fifo_addr = self.get_cmd_addr(self.cmd_idx)
 		if (not self.stfu):
 			self.log("got cmd at 0x%x n=%d" % (fifo_addr, self.cmd_idx))
@@ -541,6 +922,23 @@ class AVDEmulator:
 			0xe000e118: (self.read_isen, self.write_isen),
 			0xe000e11c: (self.read_isen, self.write_isen),
 		}
+		self.set_mmio_tables()
+
+	def set_mmio_tables(self):
+		# Resolve the r_/w_ handlers once instead of per access
+		self.mmio_rtab = {}
+		self.mmio_wtab = {}
+		for name in dir(self):
+			if (name[:2] not in ["r_", "w_"]): continue
+			try:
+				addr = int(name[2:], 16)
+			except ValueError:
+				continue
+			tab = self.mmio_rtab if name[0] == "r" else self.mmio_wtab
+			tab[addr] = getattr(self, name)
+		for addr, (read_fn, write_fn) in self.mmio_map.items():
+			self.mmio_rtab[addr] = read_fn
+			self.mmio_wtab[addr] = write_fn
 
 	def set_mmio_defaults(self):
 		avd_w32 = self.avd_w32
@@ -585,7 +983,34 @@ class AVDEmulator:
 		return addr
 
 	def doorbell_ring(self):
+		self.doorbell_count += 1
+		self.cmd_seq += 1
+		slot = self.cmd_queue[0] if self.cmd_queue else self.cmd_idx
+		opcode = struct.unpack("<I", self.avd_read(self.get_cmd_addr(slot), 4))[0] & 0x1f
+		if (self.profiler):
+			key = AVD_CM3_MODE_NAMES[self.mode] if opcode == AVD_CM3_CMD_DECODE else "cmd_%d" % (opcode)
+			self.profiler.begin(key, 0x619c, self.emu.reg_read(UC_ARM_REG_SP))
+		if (self.capture_sram):
+			sram0 = self.read_sram32()
+		inst_count = self.inst_count
+		t = time.perf_counter()
 		self.trigger_irq(0x619d) # IRQ #4
+		if (self.capture_sram):
+			sram1 = self.read_sram32()
+			changed = np.flatnonzero(sram0 != sram1)
+			self.sram_deltas.append({"cmd": self.cmd_seq, "opcode": opcode, "mode": self.mode,
+				"paths": self.frame_paths if opcode == AVD_CM3_CMD_DECODE else [],
+				"off": (changed * 4).astype(np.uint32), "old": sram0[changed], "new": sram1[changed]})
+		t1 = time.perf_counter()
+		self.cmd_stats.append({"opcode": opcode,
+			"insts": self.inst_count - inst_count if self.count_insts else None,
+			"time": t1 - t, "stop": self.stop_reason})
+		if (self.tracer):
+			name = AVD_CM3_MODE_NAMES.get(self.mode, "?") if opcode == AVD_CM3_CMD_DECODE else "cmd_%d" % (opcode)
+			self.tracer.span("emu %s" % (name), t, t1, cat="emu", cmd=self.cmd_seq, opcode=opcode,
+				paths=list(self.frame_paths) if opcode == AVD_CM3_CMD_DECODE else [], stop=self.stop_reason)
+		if (self.profiler):
+			self.profiler.end()
 
 	def avd_send_cmd(self, cmd):
 		addr = self.get_cmd_addr(self.cmd_idx)
@@ -601,17 +1026,172 @@ class AVDEmulator:
 		cmd = b'\00' * AVD_CM3_CMD_SIZE # AVD_CM3_CMD_INIT
 		self.avd_send_cmd(cmd)
 
-	def avd_cm3_cmd_decode(self, path):
-		self.avd_cm3_cmd_init() # prep
+	def avd_cm3_cmd_decode(self, path, frame_params=None):
+		self.frame_paths = []
+		if (self.boot_snap is not None):
+			self.restore(self.boot_snap)
+		else:
+			self.avd_cm3_cmd_init() # prep
 		self.status_poll_count = 0 # reset
+		self.cmd_stats = []
 		self.status_val = 0x842108
 		self.inst_stream = []
-		cmd = self.set_params(path)
+		cmd = self.set_params(path, frame_params)
 		self.avd_send_cmd(cmd)
 		# avd.trigger_irq(0x6ab9) # post-decode irq ack
 		# avd.trigger_irq(0x7a63) # post-decode wfi
 		return self.inst_stream
 
+	def avd_cm3_cmd_decode_batch(self, paths):
+		# Queue up to AVD_CM3_FIFO_COUNT decodes in the SRAM command slots with
+		# their frame_params resident at their own DART1 slots, and ring once.
+		# If the firmware returns to WFI with commands left, ring again.
+		assert((len(paths) > 0) and (len(paths) <= AVD_CM3_FIFO_COUNT))
+		self.frame_paths = []
+		if (self.boot_snap is not None):
+			self.restore(self.boot_snap)
+		else:
+			self.avd_cm3_cmd_init() # prep
+		self.status_poll_count = 0
+		self.status_val = 0x842108
+		self.inst_stream = []
+		self.inst_streams = []
+		self.doorbell_count = 0
+		self.cmd_stats = []
+
+		fifo_slots = []
+		for n, path in enumerate(paths):
+			cmd = self.set_params(path)
+			if (self.fifo1_idx % AVD_CM3_FIFO_COUNT in fifo_slots):
+				raise ValueError("%s collides with a queued CM3 FIFO slot" % (path))
+			fifo_slots.append(self.fifo1_idx % AVD_CM3_FIFO_COUNT)
+			self.avd_write(self.get_cmd_addr(n), cmd[:AVD_CM3_CMD_SIZE])
+		self.cmd_queue = list(range(len(paths)))
+
+		while (self.cmd_queue):
+			left = len(self.cmd_queue)
+			self.status_poll_count = 0
+			self.doorbell_ring()
+			if (len(self.cmd_queue) == left):
+				raise RuntimeError("firmware did not retrieve a queued command")
+		self.cmd_idx = 0
+		self.log("Batch of %d commands took %d doorbells" % (len(paths), self.doorbell_count))
+		return self.inst_streams
+
+class AVDEmulatorCache:
+	# Inst streams keyed by (firmware, frame_params, emulator version) hashes,
+	# stored as packed u32 blobs and evicted least-recently-used past max_size
+	def __init__(self, path, firmware, max_size=1 << 30):
+		self.fw_hash = hashlib.sha256(open(firmware, "rb").read()).hexdigest()
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		self.db = sqlite3.connect(path)
+		self.db.execute("CREATE TABLE IF NOT EXISTS insts (key TEXT PRIMARY KEY, words BLOB, size INTEGER, atime REAL)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS insts_atime ON insts (atime)")
+
+	def get_key(self, path):
+		h = hashlib.sha256()
+		h.update(self.fw_hash.encode())
+		h.update(b"%d" % (AVD_EMU_VERSION))
+		h.update(open(path, "rb").read())
+		return h.hexdigest()
+
+	def get(self, path):
+		key = self.get_key(path)
+		row = self.db.execute("SELECT words FROM insts WHERE key = ?", (key,)).fetchone()
+		if (row is None):
+			self.misses += 1
+			return None
+		self.db.execute("UPDATE insts SET atime = ? WHERE key = ?", (time.time(), key))
+		self.db.commit()
+		self.hits += 1
+		return array('I', row[0]).tolist()
+
+	def put(self, path, inst):
+		buf = array('I', inst).tobytes()
+		self.db.execute("INSERT OR REPLACE INTO insts VALUES (?, ?, ?, ?)", (self.get_key(path), buf, len(buf), time.time()))
+		self.evict()
+		self.db.commit()
+
+	def evict(self):
+		total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM insts").fetchone()[0]
+		if (total <= self.max_size): return
+		for key, size in self.db.execute("SELECT key, size FROM insts ORDER BY atime").fetchall():
+			self.db.execute("DELETE FROM insts WHERE key = ?", (key,))
+			total -= size
+			if (total <= self.max_size): break
+
+	def close(self):
+		self.db.close()
+
+_pool_emu = None
+
+def _pool_init(firmware, snapshot, kwargs):
+	global _pool_emu
+	_pool_emu = AVDEmulator(firmware, **kwargs)
+	_pool_emu.boot(snapshot)
+
+def _pool_decode(job):
+	n, path = job
+	t = time.perf_counter()
+	inst = _pool_emu.avd_cm3_cmd_decode(path)
+	return n, array('I', inst).tobytes(), t, time.perf_counter(), os.getpid()
+
+def _pool_decode_buf(frame_params):
+	t = time.perf_counter()
+	inst = _pool_emu.avd_cm3_cmd_decode("<buf>", frame_params)
+	return array('I', inst).tobytes(), t, time.perf_counter(), os.getpid()
+
+class AVDEmulatorPool:
+	# Workers each hold a warm emulator restored from one boot snapshot
+	def __init__(self, firmware, jobs=0, snapshot=None, tracer=None, **kwargs):
+		# Workers can't share the tracer, so they send back timestamps and
+		# the spans are recorded here under the worker's pid
+		self.tracer = tracer
+		kwargs.setdefault("stfu", True)
+		kwargs.setdefault("fast", True)
+		self.jobs = jobs if jobs else os.cpu_count()
+		self.tmpdir = None
+		if (not snapshot):
+			self.tmpdir = tempfile.TemporaryDirectory(prefix="avd_emu")
+			snapshot = os.path.join(self.tmpdir.name, "boot.snap")
+		if (not os.path.exists(snapshot)):
+			AVDEmulator(firmware, **kwargs).boot(snapshot)
+		self.pool = multiprocessing.Pool(self.jobs, initializer=_pool_init,
+				initargs=(firmware, snapshot, kwargs))
+		self.times = []
+		self.elapsed = 0
+
+	def map(self, paths, chunksize=1):
+		streams = [None] * len(paths)
+		times = [0] * len(paths)
+		t = time.perf_counter()
+		for n, buf, t0, t1, pid in self.pool.imap_unordered(_pool_decode, enumerate(paths), chunksize):
+			streams[n] = array('I', buf).tolist()
+			times[n] = t1 - t0
+			if (self.tracer):
+				self.tracer.span("emu decode", t0, t1, cat="emu", pid=pid, tid=pid, path=paths[n])
+		self.elapsed = time.perf_counter() - t
+		self.times = times
+		return streams
+
+	def decode(self, frame_params):
+		# Blocking single decode, safe to call from several threads
+		buf, t0, t1, pid = self.pool.apply(_pool_decode_buf, (frame_params,))
+		if (self.tracer):
+			self.tracer.span("emu decode", t0, t1, cat="emu", pid=pid, tid=pid)
+		return buf
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+		if (self.tmpdir):
+			self.tmpdir.cleanup()
+
+	def __enter__(self): return self
+	def __exit__(self, *args): self.close()
+
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(prog='AVD CM3 Firmware Emulator')
 	parser.add_argument('-f', '--firmware', type=str, required=True, help="path to firmware")
@@ -625,18 +1205,27 @@ if __name__ == "__main__":
 	parser.add_argument('-a', '--all', action='store_true', help="emulate all in dir")
 
 	parser.add_argument('-r', '--trace-sram', action='store_true', help="trace SRAM R/Ws")
+	parser.add_argument('-R', '--ring', type=str, default="", choices=["", "sram", "mmio", "all"], help="record accesses to a ring buffer instead of printing")
+	parser.add_argument('--ring-size', type=int, default=1 << 20, help="ring buffer records")
+	parser.add_argument('--ring-out', type=str, default="trace.npy", help="ring buffer dump path")
 	parser.add_argument('-c', '--trace-code', action='store_true', help="trace code")
 	parser.add_argument('-m', '--format-mmio', action='store_true', help="format MMIO R/Ws")
 	parser.add_argument('-v', '--verbose', action='store_true', help="verbose")
 	parser.add_argument('-t', '--stfu', action='store_true')
+	parser.add_argument('-I', '--count-insts', action='store_true', help="count executed instructions per command")
+	parser.add_argument('-D', '--sram-deltas', type=str, default="", help="write per-command SRAM deltas (.npz) here")
+	parser.add_argument('-P', '--profile', type=str, default="", help="write a per-codec firmware profile JSON here")
+	parser.add_argument('-F', '--fast', action='store_true', help="only hook registers the inst stream needs")
+	parser.add_argument('-w', '--warm', action='store_true', help="boot once and restore a snapshot per decode")
+	parser.add_argument('-S', '--snapshot', type=str, default="", help="boot snapshot path for -w (created if missing)")
+	parser.add_argument('-B', '--batch', action='store_true', help="queue %d decode commands per doorbell" % (AVD_CM3_FIFO_COUNT))
+	parser.add_argument('-j', '--jobs', type=int, default=1, help="emulate in N warm worker processes (0 for all cores)")
+	parser.add_argument('-T', '--trace', type=str, default="", help="write a Chrome trace-event JSON timeline here")
 
 	parser.add_argument('-u', '--inst-only', action='store_true', help="trace instruction stream only")
 	parser.add_argument('-b', '--show-bits', action='store_true', help="show bits on the side for -u")
 	args = parser.parse_args()
 
-	emu = AVDEmulator(**vars(args))
-	emu.start()
-
 	if (args.dir):
 		paths = os.listdir(os.path.join(args.prefix, args.dir))
 		paths = sorted([os.path.join(args.prefix, args.dir, path) for path in paths if "param" in path or "frame" in path])
@@ -644,7 +1233,46 @@ if __name__ == "__main__":
 	else:
 		paths = [args.path]
 
-	for path in paths:
-		print(path)
-		inst = emu.avd_cm3_cmd_decode(path)
-		# do whatever you need to do with 'inst'...
+	tracer = None
+	if (args.trace):
+		from avid.trace import AVDTracer
+		tracer = AVDTracer(args.trace, "avd_emu")
+
+	if (args.jobs != 1):
+		kwargs = {k: v for k, v in vars(args).items() if k not in ["firmware", "snapshot", "jobs", "trace"]}
+		with AVDEmulatorPool(args.firmware, args.jobs, args.snapshot, tracer, **kwargs) as pool:
+			insts = pool.map(paths)
+			for path, inst, dt in zip(paths, insts, pool.times):
+				print("%s: %d words %.1f ms" % (path, len(inst), dt * 1e3))
+			print("%d frames in %.2f s: %.1f frames/s (%.1f frames/s/worker)" % (len(paths), pool.elapsed,
+				len(paths) / pool.elapsed, len(paths) / sum(pool.times)))
+		if (tracer):
+			tracer.save()
+		sys.exit(0)
+
+	emu = AVDEmulator(tracer=tracer, **vars(args))
+	if (args.warm or args.snapshot):
+		emu.boot(args.snapshot)
+	else:
+		emu.start()
+
+	if (args.batch):
+		for n in range(0, len(paths), AVD_CM3_FIFO_COUNT):
+			batch = paths[n:n+AVD_CM3_FIFO_COUNT]
+			insts = emu.avd_cm3_cmd_decode_batch(batch)
+			for path, inst in zip(batch, insts):
+				print(path)
+	else:
+		for path in paths:
+			print(path)
+			inst = emu.avd_cm3_cmd_decode(path)
+			# do whatever you need to do with 'inst'...
+
+	if (args.profile):
+		emu.profiler.save(args.profile)
+	if (args.ring):
+		emu.ring.save(args.ring_out)
+	if (args.sram_deltas):
+		emu.save_sram_deltas(args.sram_deltas)
+	if (tracer):
+		tracer.save()
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: MIT
 import inspect, re, sys, os, time
+import hashlib, marshal
 
+import construct
 from construct import *
-from construct.core import evaluate
+from construct.core import evaluate, CodeGen, Compiled
 from construct.lib import HexDisplayedInteger, stringtypes, reprstring
 from .utils import *
 from math import ceil
@@ -11,9 +13,133 @@ from math import ceil
 def ZPadding(size):
     return Const(bytes(size), Bytes(size))
 
+class U8Array(Adapter):
+    """ Array(count, Int8ul) in one read, also when compiled """
+    def __init__(self, count):
+        super().__init__(Bytes(count))
+        self.count = count
+
+    def _decode(self, obj, context, path):
+        return ListContainer(obj)
+
+    def _encode(self, obj, context, path):
+        return bytes(obj)
+
+    def _emitparse(self, code):
+        return f"ListContainer({self.subcon._compileparse(code)})"
+
 class Ver:
     pass
 
+# Opt-in: parse through construct's compiler. Off by default since the
+# compiled parsers don't report which field failed as nicely.
+g_compile = os.environ.get("AVD_CONSTRUCT_COMPILE", "0") not in ("", "0")
+g_compile_cache = os.environ.get("AVD_CONSTRUCT_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "avd", "construct"))
+
+def set_compile(enable=True, cache_dir=None):
+    """ Parse ConstructClasses with compiled parsers. cache_dir holds the
+        bytecode of the generated parsers across runs ("" to disable).
+    """
+    global g_compile, g_compile_cache
+    g_compile = enable
+    if cache_dir is not None:
+        g_compile_cache = cache_dir
+
+_compile_preamble = """
+    from construct import *
+    from construct.lib import *
+    from io import BytesIO
+    import struct
+    import collections
+    import itertools
+
+    def restream(data, func):
+        return func(BytesIO(data))
+    def reuse(obj, func):
+        return func(obj)
+
+    len_ = len
+    sum_ = sum
+    min_ = min
+    max_ = max
+    abs_ = abs
+"""
+
+# construct's generator reads fixed arrays one element at a time and links
+# validators (and everything under them) back to the interpreter. Emit
+# both inline; only compile_parser() generates code, so this is opt-in too.
+_array_emitparse = Array._emitparse
+
+def _emitparse_array(self, code):
+    sc = self.subcon
+    while isinstance(sc, Hex):
+        sc = sc.subcon
+    if not (isinstance(self.count, int) and isinstance(sc, FormatField) and not self.discard):
+        return _array_emitparse(self, code)
+    fname = f"formatarray_{code.allocateId()}"
+    code.append(f"{fname} = struct.Struct({repr(sc.fmtstr[0] + str(self.count) + sc.fmtstr[1:])})")
+    return f"ListContainer({fname}.unpack(io.read({sc.length * self.count})))"
+
+def _emitparse_validator(self, code):
+    code.linkedinstances[id(self)] = self
+    return f"linkedinstances[{id(self)}]._decode({self.subcon._compileparse(code)}, this, '(???)')"
+
+Array._emitparse = _emitparse_array
+Validator._emitparse = _emitparse_validator
+
+def compile_parser(subcon, name=""):
+    """ Like subcon.compile(), parse only. Subcons the compiler can't
+        emit (validators, nested ConstructClasses) stay linked in as is.
+    """
+    code = CodeGen()
+    code.append(_compile_preamble)
+    code.append(f"""
+        def parseall(io, this):
+            return {subcon._compileparse(code)}
+    """)
+    source = code.toString()
+
+    # linked instances are keyed by id(); renumber so the source is the
+    # same across runs and can key the bytecode cache
+    linked = {}
+    for n,key in enumerate(code.linkedinstances):
+        source = source.replace(f"[{key}]", f"[{n}]")
+        linked[n] = code.linkedinstances[key]
+
+    co = None
+    path = None
+    if g_compile_cache:
+        tag = "%s-%s-%d.%d" % (source, construct.version_string, *sys.version_info[:2])
+        key = hashlib.sha1(tag.encode()).hexdigest()
+        path = os.path.join(g_compile_cache, f"{name}-{key}.bin")
+        try:
+            with open(path, "rb") as f:
+                co = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            co = None
+    if co is None:
+        co = compile(source, f"<construct {name}>", "exec")
+        if path:
+            try:
+                os.makedirs(g_compile_cache, exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    marshal.dump(co, f)
+                os.replace(path + ".tmp", path)
+            except OSError:
+                pass
+
+    glob = {
+        "linkedinstances": linked,
+        "linkedparsers": {n: inst._parse for n,inst in linked.items()},
+        "linkedbuilders": {},
+    }
+    exec(co, glob)
+    compiled = Compiled(glob["parseall"], None)
+    compiled.source = source
+    compiled.defersubcon = subcon
+    return compiled
+
 class ReloadableMeta(type):
     def __new__(cls, name, bases, dct):
         m = super().__new__(cls, name, bases, dct)
@@ -292,14 +418,12 @@ class ConstructClassBase(Reloadable, metaclass=ReloadableConstructMeta):
         raise NotImplementedError()
 
     @classmethod
-    def _set_meta(cls, self, stream=None):
-        if stream is not None:
-            self._pointers = set()
-            self._meta = {}
-            self._stream = stream
-
-        if isinstance(cls.subcon, Struct):
-            subaddr = int(self._addr)
+    def _get_meta_fields(cls):
+        # (name, sizeof, is_pointer) per leading fixed-size field, computed
+        # once per class. A reloaded class is a new class, so no staleness
+        fields = cls.__dict__.get("_meta_fields")
+        if fields is None:
+            fields = []
             for subcon in cls.subcon.subcons:
                 try:
                     sizeof = subcon.sizeof()
@@ -308,18 +432,49 @@ class ConstructClassBase(Reloadable, metaclass=ReloadableConstructMeta):
                 if isinstance(subcon, Ver):
                     subcon = subcon.subcon
                 if isinstance(subcon, Renamed):
-                    name = subcon.name
-                    #print(name, subcon)
-                    subcon = subcon.subcon
-                    if stream is not None and getattr(stream, "meta_fn", None):
-                        meta = stream.meta_fn(subaddr, sizeof)
+                    fields.append((subcon.name, sizeof, isinstance(subcon.subcon, Pointer)))
+                else:
+                    fields.append((None, sizeof, False))
+            cls._meta_fields = fields
+        return fields
+
+    @classmethod
+    def _get_parser(cls):
+        parser = cls.__dict__.get("_parser")
+        if parser is None or parser[0] != g_compile:
+            sc = cls.subcon
+            if g_compile and not isinstance(sc, Select):
+                # codegen can't do everything: unsupported subcons raise
+                # NotImplementedError, and lambdas (e.g. RepeatUntil) are
+                # emitted as their repr, which doesn't compile
+                try:
+                    sc = compile_parser(sc, cls.__name__)
+                except (NotImplementedError, SyntaxError) as e:
+                    print(f"[construct] {cls.__name__}: interpreted ({type(e).__name__}: {e})", file=sys.stderr)
+            parser = (g_compile, sc)
+            cls._parser = parser
+        return parser[1]
+
+    @classmethod
+    def _set_meta(cls, self, stream=None):
+        if stream is not None:
+            self._pointers = set()
+            self._meta = {}
+            self._stream = stream
+
+        if isinstance(cls.subcon, Struct):
+            subaddr = int(self._addr)
+            meta_fn = getattr(stream, "meta_fn", None) if stream is not None else None
+            for name, sizeof, is_pointer in cls._get_meta_fields():
+                if name is not None:
+                    if meta_fn:
+                        meta = meta_fn(subaddr, sizeof)
                         if meta is not None:
                             self._meta[name] = meta
-                    if isinstance(subcon, Pointer):
+                    if is_pointer:
                         self._pointers.add(name)
                         continue
                     try:
-                        #print(name, subcon)
                         val = self[name]
                     except:
                         pass
@@ -339,7 +494,7 @@ class ConstructClassBase(Reloadable, metaclass=ReloadableConstructMeta):
     def _parse(cls, stream, context, path):
         #print(f"parse {cls} @ {stream.tell():#x} {path}")
         addr = stream.tell()
-        obj = cls.subcon._parse(stream, context, path)
+        obj = cls._get_parser()._parse(stream, context, path)
         size = stream.tell() - addr
 
         # Don't instance Selects
@@ -447,14 +602,6 @@ class ConstructClass(ConstructClassBase, Container):
     @classmethod
     def _parse(cls, stream, context, path):
         self = ConstructClassBase._parse.__func__(cls, stream, context, path)
-
-        for key in self:
-            if key.startswith('_'):
-                continue
-            try:
-                val = int(self[key])
-            except:
-                continue
         if (hasattr(self, "_post_parse")):
             self = self._post_parse(self)
         return self
@@ -564,4 +711,4 @@ class ConstructValueClass(ConstructClassBase):
         self.value = obj
     _apply_classful = _apply
 
-__all__ = ["ConstructClass", "ConstructValueClass", "ZPadding"]
+__all__ = ["ConstructClass", "ConstructValueClass", "ZPadding", "U8Array", "set_compile", "compile_parser"]
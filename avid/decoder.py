@@ -4,6 +4,9 @@
 
 from collections import namedtuple
 from dataclasses import dataclass
+from time import perf_counter
+from .stats import AVDStats
+from .trace import AVDTracer
 from .utils import *
 
 @dataclass(slots=True)
@@ -20,6 +23,18 @@ class AVDOutputFormat:
 	bitdepth_luma: int = 8
 	bitdepth_chroma: int = 8
 
+@dataclass(slots=True)
+class AVDOutputPicture:
+	poc: int
+	timestamp: int
+	access_idx: int
+	idx: int
+	addr: int
+	latency: int = 0
+
+	def __repr__(self):
+		return f"[output: poc: {str(self.poc).rjust(3)} ts: {str(self.timestamp).rjust(3)} access_idx: {str(self.access_idx).rjust(3)} idx: {str(self.idx).rjust(2)} addr: {hex(self.addr >> 7).ljust(2+5)}]"
+
 class AVDRange(namedtuple('AVDRange', ['iova', 'size', 'name'])):
 	def __repr__(self):
 		return f"[iova: {hex(self.iova).rjust(7+2)} size: {hex(self.size).rjust(7+2)} name: {str(self.name).ljust(11)}]"
@@ -34,6 +49,9 @@ class AVDDecoder:
 		self.ffp = {}
 		self.last_iova = 0x0
 		self.used = []
+		self.output = []
+		self.perf = None
+		self.tracer = None
 
 	def log(self, x, cl=""):
 		prefix = f"[{cl}]" if cl else cl
@@ -43,6 +61,7 @@ class AVDDecoder:
 	def reset_allocator(self):
 		self.last_iova = 0x0
 		self.used = []
+		self.hal.reset_templates()  # templates bake in buffer addresses
 
 	def range_alloc(self, size, pad=0x0, padb4=0x0, align=0x0, name=""):
 		iova = self.last_iova
@@ -54,6 +73,8 @@ class AVDDecoder:
 			name = "range_%d" % len(self.used)
 		self.used.append(AVDRange(iova, size, name))
 		self.last_iova = iova + size + pad
+		if (self.perf):
+			self.perf.gauge("allocator_top", self.last_iova)
 		return iova
 
 	def allocator_move_up(self, start):
@@ -70,6 +91,8 @@ class AVDDecoder:
 		ctx = self.ctx
 		size = len(sl.get_payload())
 		if (size > ctx.slice_data_size):
+			if (self.perf):
+				self.perf.count("slice_data_realloc")
 			self.range_free(name="slice_data")
 			ctx.slice_data_addr = self.range_alloc(size, align=0x4000, name="slice_data")
 			ctx.slice_data_size = size
@@ -82,6 +105,47 @@ class AVDDecoder:
 			self.log(s)
 		self.log("last iova: 0x%08x" % (self.last_iova))
 
+	def queue_output(self, pic, sl):
+		# Picture is "needed for output". Keep a snapshot, not the pool entry,
+		# since the macOS pool algo recycles buffers regardless of display order
+		ctx = self.ctx
+		timestamp = sl.get("timestamp", ctx.access_idx)
+		out = AVDOutputPicture(poc=pic.poc, timestamp=timestamp, access_idx=ctx.access_idx, idx=pic.idx, addr=pic.addr)
+		ctx.output_list.append(out)
+		return out
+
+	def bump_output(self):
+		# C.4.5.3/C.5.2.4 "bumping": output the smallest POC waiting in the DPB
+		ctx = self.ctx
+		if (not len(ctx.output_list)):
+			return None
+		out = min(ctx.output_list, key=lambda x: x.poc)
+		ctx.output_list.remove(out)
+		self.log(f"Bumping {out}")
+		self.output.append(out)
+		return out
+
+	def flush_output(self, discard=False):
+		ctx = self.ctx
+		if (discard):
+			for out in ctx.output_list:
+				self.log(f"Discarding {out}")
+			ctx.output_list = []
+		while (len(ctx.output_list)):
+			self.bump_output()
+
+	def get_output(self):
+		# Pictures in display order released since the last call
+		out = self.output
+		self.output = []
+		return out
+
+	def flush(self):
+		# End of stream: drain everything left in display order
+		if (self.ctx):
+			self.flush_output()
+		return self.get_output()
+
 	def init_slice(self):
 		pass
 
@@ -94,23 +158,102 @@ class AVDDecoder:
 	def setup(self, path):
 		raise NotImplementedError()
 
+	def enable_stats(self, path="", interval=10.0, fmt=""):
+		# path: also dump every interval seconds, as Prometheus text if fmt
+		# is "prom" or path ends in .prom/.txt, else JSON
+		self.perf = AVDStats(path, interval, fmt)
+		self.hal.perf = self.perf
+		return self.perf
+
+	def disable_stats(self):
+		self.perf = None
+		self.hal.perf = None
+
+	def stats(self):
+		return self.perf.get() if self.perf else {}
+
+	def enable_trace(self, path="", tracer=None):
+		# Chrome trace-event spans per frame and stage; share tracer to put
+		# several decoders (or the emulator) on one timeline
+		self.tracer = tracer if tracer else AVDTracer(path)
+		self.parser.tracer = self.tracer
+		return self.tracer
+
+	def disable_trace(self):
+		self.tracer = None
+		self.parser.tracer = None
+
+	def timed(self, stage, fn, *args, **kwargs):
+		if (not (self.perf or self.tracer)):
+			return fn(*args, **kwargs)
+		t = perf_counter()
+		ret = fn(*args, **kwargs)
+		t1 = perf_counter()
+		if (self.perf):
+			self.perf.add_time(stage, t1 - t)
+		if (self.tracer):
+			self.tracer.span(stage, t, t1, cat="decoder", codec=self.mode)
+		return ret
+
+	def get_dpb_size(self):
+		return len(self.ctx.dpb_list)
+
+	def get_slice_type(self, sl):
+		return sl.get_slice_str(sl.slice_type)
+
+	def record_decode(self, sl, inst_stream, t0, t1, t2, t3, t4):
+		perf = self.perf
+		if (perf):
+			perf.add_time("init_slice", t1 - t0)
+			perf.add_time("hal_decode", t2 - t1)
+			perf.add_time("make_ffp", t3 - t2)
+			perf.add_time("finish_slice", t4 - t3)
+			perf.gauge("dpb_size", self.get_dpb_size())
+			perf.add_frame(len(inst_stream))
+		tracer = self.tracer
+		if (tracer):
+			args = {"codec": self.mode, "frame": sl.idx, "slice_type": self.get_slice_type(sl)}
+			tracer.span("frame", t0, t4, cat="frame", words=len(inst_stream), **args)
+			tracer.span("init_slice", t0, t1, cat="decoder", **args)
+			tracer.span("hal.decode", t1, t2, cat="decoder", **args)
+			tracer.span("make_ffp", t2, t3, cat="decoder", **args)
+			tracer.span("finish_slice", t3, t4, cat="decoder", **args)
+
 	def decode(self, sl):
+		timing = self.perf or self.tracer
 		self.ctx.active_sl = sl
+		t0 = perf_counter() if timing else 0
 		self.init_slice()
+		t1 = perf_counter() if timing else 0
 		inst_stream = self.hal.decode(self.ctx, sl)
+		t2 = perf_counter() if timing else 0
 		self.ffp = self.make_ffp(inst_stream)
+		t3 = perf_counter() if timing else 0
 		self.finish_slice()
+		if (timing):
+			self.record_decode(sl, inst_stream, t0, t1, t2, t3, perf_counter())
 		return inst_stream
 
 	def make_ffp(self, inst_stream):
 		ffp = self.fpcls._ffpcls.new()
-		for inst in inst_stream:
-			if (isinstance(inst.idx, int)):
-				ffp[inst.name][inst.idx] = inst.val
+		for val, name, idx in inst_stream.items():
+			if (isinstance(idx, int)):
+				ffp[name][idx] = val
 			else:
-				ffp[inst.name] = inst.val
+				ffp[name] = val
 		return ffp
 
+	def get_pio_header(self):
+		# PIODMA header words the driver puts in front of the inst stream
+		raise NotImplementedError()
+
+	def build_fp(self, buf=None):
+		# raw frame_params bytes for the last decoded frame, PIODMA header
+		# included so it can be fed to AVDEmulator.set_params as is. The
+		# H.265 input tiles aren't generated yet and are left as in buf.
+		buf = self.fpcls.build_ffp(self.ffp, buf)
+		return self.fpcls.build_ffp(self.get_pio_header(), buf)
+
 	def calc_rvra(self, chroma):
 		ctx = self.ctx
 		# reference VRA (video resolution adaptation) scaler buffer.
@@ -6,16 +6,248 @@ from construct import *
 from construct.lib import *
 from .constructutils import *
 from math import ceil
+import numpy as np
+import struct
 
 u8 = Hex(Int8ul)
 u16 = Hex(Int16ul)
 u32 = Hex(Int32ul)
 u64 = Hex(Int64ul)
 
+_np_formats = {"B": "u1", "H": "<u2", "L": "<u4", "I": "<u4", "Q": "<u8",
+               "b": "i1", "h": "<i2", "l": "<i4", "i": "<i4", "q": "<i8"}
+
+def _field_format(subcon):
+    # (struct format char, array count or 0, validator or None) for
+    # u8-u64 fields and fixed arrays of them, else None
+    count = 0
+    validator = None
+    while True:
+        if isinstance(subcon, Array):
+            if not isinstance(subcon.count, int):
+                return None
+            count = subcon.count
+        elif isinstance(subcon, Const):
+            return None
+        elif isinstance(subcon, FormatField):
+            return subcon.fmtstr[1:], count, validator
+        elif not isinstance(subcon, Subconstruct):
+            return None
+        if isinstance(subcon, ExprValidator) and validator == None:
+            validator = subcon._validate
+        subcon = subcon.subcon
+
 class AVDFrameParams(ConstructClass):
+    _counts = {}  # {RepeatUntil field: capacity}, see _fields()
+
     def __init__(self):
         super().__init__()
 
+    @classmethod
+    def _fields(cls, full=False):
+        # (name, offset, subcon) for every field at a fixed offset. The
+        # walk stops at the first variable-size field. With full, such a
+        # field needs its capacity (the driver's fixed allocation) in
+        # _counts instead, and a RepeatUntil of it becomes an Array.
+        off = 0
+        for subcon in cls.subcon.subcons:
+            try:
+                sizeof = subcon.sizeof()
+            except:
+                if (not full):
+                    break  # e.g. RepeatUntil; nothing after it has a fixed offset
+                sc = subcon.subcon
+                if isinstance(sc, type) and issubclass(sc, AVDFrameParams):
+                    sizeof = list(sc._fields(full))[-1][1]
+                elif (subcon.name in cls._counts):
+                    subcon = Renamed(Array(cls._counts[subcon.name], sc.subcon), subcon.name)
+                    sizeof = subcon.sizeof()
+                else:
+                    raise ValueError("%s.%s has no fixed size, give it a capacity in _counts" % (cls.__name__, subcon.name))
+            if isinstance(subcon, Renamed):
+                yield subcon.name, off, subcon.subcon
+            off += sizeof
+        yield None, off, None
+
+    @classmethod
+    def get_layout(cls, base=0, prefix=""):
+        # {name: (offset, struct, count)}, flattened through nested
+        # frame_params classes. Nested fields are also keyed by their
+        # dotted path (e.g. til.til_abc_tiles.til_ab4_tile_addr_low), array
+        # elements by index (e.g. inp.inp[1].til_0_pio_src_addr); a plain
+        # name repeated by an embedded struct keeps the first one.
+        layout = {}
+        for name, off, sc in cls._fields(full=True):
+            if (name == None):
+                if (base == 0):
+                    size = cls.__dict__.get("_size", off)
+                    if (off > size):
+                        raise ValueError("%s: fields end at 0x%x, past _size 0x%x" % (cls.__name__, off, size))
+                    layout["_size"] = size
+            elif isinstance(sc, type) and issubclass(sc, AVDFrameParams):
+                for key, ent in sc.get_layout(base + off, prefix + name + ".").items():
+                    layout.setdefault(key, ent)
+            elif isinstance(sc, Array) and isinstance(sc.subcon, type):
+                # lay out one element, then shift it along the array
+                sub = sc.subcon.get_layout()
+                stride = sub.pop("_size")
+                for n in range(sc.count):
+                    for key, (x, st, count) in sub.items():
+                        ent = (base + off + n * stride + x, st, count)
+                        layout.setdefault(key, ent)
+                        if ("." not in key):
+                            layout["%s%s[%d].%s" % (prefix, name, n, key)] = ent
+            else:
+                fmt = _field_format(sc)
+                if (fmt != None):
+                    ch, count, _ = fmt
+                    st = struct.Struct("<%d%s" % (count, ch) if count else "<" + ch)
+                    layout.setdefault(name, (base + off, st, count))
+                    if (prefix):
+                        layout[prefix + name] = (base + off, st, count)
+        return layout
+
+    @classmethod
+    def _get_layout(cls):
+        # get_layout() walks the construct tree; this is per frame_params class
+        layout = cls.__dict__.get("_layout")
+        if (layout == None):
+            layout = cls.get_layout()
+            cls._layout = layout
+        return layout
+
+    @classmethod
+    def get_word_mask(cls, keys):
+        """ u32 word indices of keys (name or (name, count)) in the blob,
+            with the field name and element index of each word
+        """
+        layout = cls._get_layout()
+        idx, names, elems = [], [], []
+        for key in keys:
+            name, count = (key, None) if isinstance(key, str) else key
+            off, st, fnum = layout[name]
+            assert(st.format[-1] in "IL" and not (off & 3))
+            num = count if count else max(fnum, 1)
+            idx.extend(range(off // 4, off // 4 + num))
+            names.extend([name] * num)
+            elems.extend(range(num) if fnum else [None])
+        return np.array(idx, dtype=np.intp), names, elems
+
+    @classmethod
+    def diff_words(cls, buf0, buf1, mask):
+        """ Compare the masked u32 words of two blobs in one pass. Words
+            that are zero in buf1 are skipped (N/A fields filled by macOS).
+            Returns [(name, elem, x0, x1)] for mismatches only.
+        """
+        idx, names, elems = mask
+        w0 = np.frombuffer(buf0, dtype="<u4", count=len(buf0) // 4)[idx]
+        w1 = np.frombuffer(buf1, dtype="<u4", count=len(buf1) // 4)[idx]
+        bad = np.flatnonzero((w1 != 0) & (w0 != w1))
+        return [(names[n], elems[n], int(w0[n]), int(w1[n])) for n in bad]
+
+    @classmethod
+    def get_dtype(cls):
+        """ numpy structured dtype of the same layout, nested like the
+            construct classes (e.g. view.hdr.hdr_28_height_width_shift3).
+            Fields without a fixed numeric layout (pads, bytes) are holes.
+        """
+        dtype = cls.__dict__.get("_dtype")
+        if (dtype != None):
+            return dtype
+        names, formats, offsets = [], [], []
+        validators = {}
+        for name, off, sc in cls._fields():
+            if (name == None):
+                size = off
+            elif name in names:
+                continue
+            elif isinstance(sc, type) and issubclass(sc, AVDFrameParams):
+                names.append(name); formats.append(sc.get_dtype()); offsets.append(off)
+                for key, v in sc.get_validators().items():
+                    validators[(name,) + key] = v
+            else:
+                fmt = _field_format(sc)
+                if (fmt == None):
+                    continue
+                ch, count, validator = fmt
+                names.append(name)
+                formats.append((_np_formats[ch], (count,)) if count else _np_formats[ch])
+                offsets.append(off)
+                if (validator != None):
+                    validators[(name,)] = validator
+        dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": size})
+        cls._dtype = dtype
+        cls._validators = validators
+        return dtype
+
+    @classmethod
+    def get_validators(cls):
+        cls.get_dtype()
+        return cls.__dict__["_validators"]
+
+    @classmethod
+    def frombuffer(cls, buf, count=1):
+        """ Zero-copy view of count frame_params back to back in buf.
+            Only the fixed-layout prefix of each blob is mapped.
+        """
+        return np.frombuffer(buf, dtype=cls.get_dtype(), count=count).view(np.recarray)
+
+    @classmethod
+    def fromfile(cls, path):
+        return np.memmap(path, dtype=cls.get_dtype(), mode="r", shape=(1,)).view(np.recarray)[0]
+
+    @classmethod
+    def fromfiles(cls, paths):
+        # stack the fixed-layout prefix of each file into one array
+        dtype = cls.get_dtype()
+        arr = np.zeros(len(paths), dtype=dtype)
+        raw = arr.view(np.uint8).reshape(len(paths), dtype.itemsize)
+        for n,path in enumerate(paths):
+            with open(path, "rb") as f:
+                f.readinto(memoryview(raw[n]))
+        return arr.view(np.recarray)
+
+    @classmethod
+    def validate(cls, arr):
+        """ Run the ExprValidators over a (stacked) view at once. Returns
+            {field path: indices of failing frames}, empty if all good.
+        """
+        arr = np.atleast_1d(arr)
+        bad = {}
+        for path, validator in cls.get_validators().items():
+            vals = arr
+            for key in path:
+                vals = vals[key]
+            res = np.broadcast_to(validator(vals.T, None, None), (len(arr),))
+            if (not res.all()):
+                bad[".".join(path)] = np.flatnonzero(~res)
+        return bad
+
+    @classmethod
+    def build_ffp(cls, ffp, buf=None):
+        """ Serialize ffp into the frame_params layout without construct.
+            Fields not in ffp are left as they are in buf (zero if new).
+            Keys with no field raise KeyError, bar the inst stream only
+            words named by the fake class (nofp_prefixes).
+        """
+        layout = cls._get_layout()
+        if (buf == None):
+            buf = bytearray(layout["_size"])
+        for key, val in ffp.items():
+            ent = layout.get(key)
+            if (ent == None):
+                if (key.startswith(cls._ffpcls.nofp_prefixes)):
+                    continue
+                raise KeyError("%s has no field %s" % (cls.__name__, key))
+            off, st, count = ent
+            if (count):
+                # fake lists can be longer than the field, e.g. H.265 weights
+                val = list(val[:count]) + [0] * (count - len(val))
+                st.pack_into(buf, off, *val)
+            else:
+                st.pack_into(buf, off, val)
+        return buf
+
     def __str__(self, ignore=[], other=None, show_all=False) -> str:
         if (hasattr(self, "_reprkeys")):
             s = ""
@@ -81,6 +313,8 @@ class AVDFrameParams(ConstructClass):
 
 class AVDFakeFrameParams(dict):
     # fake dict to diff with parsed frame_params
+    nofp_prefixes = ("cm3_",)  # inst stream words the CM3 makes up itself
+
     def __init__(self):
         super().__init__()
         self.keynames = ["hdr", "slc", "inp"]
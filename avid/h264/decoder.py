@@ -48,13 +48,25 @@ class AVDH264Decoder(AVDDecoder):
 		ctx.max_lt_idx = -1
 		ctx.dpb_list = []
 		ctx.dpb_pool = []
+		ctx.output_list = []
 		self.rlm.ctx = ctx
 
 	def setup(self, path, num=0, nal_stop=0, **kwargs):
-		sps_list, pps_list, slices = self.parser.parse(path, num, nal_stop, **kwargs)
+		sps_list, pps_list, slices = self.timed("parse", self.parser.parse, path, num, nal_stop, **kwargs)
 		self.new_context(sps_list, pps_list)
 		return slices
 
+	def get_pio_header(self):
+		# We don't schedule DART1 slots, so always slot 0
+		return {
+			"pio_piodma1_word": 0x27def15,
+			"pio_4_codec": 1,
+			"pio_14_deadcafe_notused": 0xdeadcafe,
+			"pio_18_101_notused": 0x101,
+			"pio_1c_slice_count": 1,  # one slice per picture
+			"pio_20_piodma3_offset": 0x8b4c0,
+		}
+
 	def refresh_sps(self, sl):
 		ctx = self.ctx
 		pps = ctx.get_pps(sl)
@@ -120,6 +132,14 @@ class AVDH264Decoder(AVDDecoder):
 		assert((width_mbs * height_mbs) <= level[4]) # MaxFS
 		assert(width_mbs <= sqrt(level[4] * 8))
 		assert(height_mbs <= sqrt(level[4] * 8))
+
+		# C.4.5.3 bumping limits; inferred to MaxDpbFrames when not signalled
+		if (sps.vui_parameters_present_flag and sps.bitstream_restriction_present_flag):
+			ctx.max_num_reorder = sps.num_reorder_frames
+			ctx.max_dec_frame_buffering = max(sps.max_dec_frame_buffering, 1)
+		else:
+			ctx.max_num_reorder = ctx.max_dpb_frames
+			ctx.max_dec_frame_buffering = ctx.max_dpb_frames
 		ctx.cur_sps_id = sps_id
 		self.allocate_buffers(sl)
 
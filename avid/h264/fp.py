@@ -153,6 +153,7 @@ class AVDH264V3FrameParams(AVDFrameParams):
 		#"inp" / AvdH264V3Input,
 	)
 	_ffpcls = AVDH264V3FakeFrameParams
+	_size = 0xb8000  # one DART1 FIFO slot; slc2/inp aren't mapped yet
 	_reprkeys = ["pio", "hdr", "scl", "slc"]
 	def __init__(self):
 		super().__init__()
@@ -2,7 +2,7 @@
 # SPDX-License-Identifier: MIT
 # Copyright 2023 Eileen Yoon <eyn@gmx.com>
 
-from ..hal import AVDHal
+from ..hal import AVDHal, pack_scaling_lists
 from ..utils import *
 from .types import *
 
@@ -60,27 +60,15 @@ class AVDH264HalV3(AVDHal):
 			push(x, "hdr_30_seq_scaling_list_dims")
 
 		if (sps.seq_scaling_matrix_present_flag and sps.seq_scaling_matrix_present_mask):
+			words_4x4 = pack_scaling_lists(sps.seq_scaling_list_4x4)
 			for i in range(6):
 				if (sps.seq_scaling_list_present_flag[i]): # Do not set default list
-					for j in range(16 // 4):
-						y = j * 4
-						x = 0
-						x |= sps.seq_scaling_list_4x4[i][y + 0] << 24
-						x |= sps.seq_scaling_list_4x4[i][y + 1] << 16
-						x |= sps.seq_scaling_list_4x4[i][y + 2] << 8
-						x |= sps.seq_scaling_list_4x4[i][y + 3] << 0
-						push(x, "scl_28c_seq_scaling_matrix_4x4", i*(16 // 4) + j)
+					self.push_words(words_4x4[i], "scl_28c_seq_scaling_matrix_4x4", i*(16 // 4))
 
+			words_8x8 = pack_scaling_lists(sps.seq_scaling_list_8x8)
 			for i in range(6):
 				if (sps.seq_scaling_list_present_flag[i + 6]):
-					for j in range(64 // 4):
-						y = j * 4
-						x = 0
-						x |= sps.seq_scaling_list_8x8[i][y + 0] << 24
-						x |= sps.seq_scaling_list_8x8[i][y + 1] << 16
-						x |= sps.seq_scaling_list_8x8[i][y + 2] << 8
-						x |= sps.seq_scaling_list_8x8[i][y + 3] << 0
-						push(x, "scl_2ec_seq_scaling_matrix_8x8", i*(64 // 4) + j)
+					self.push_words(words_8x8[i], "scl_2ec_seq_scaling_matrix_8x8", i*(64 // 4))
 
 		# TODO unsure of this order; I've yet to see both SPS/PPS
 		# PPS: Set all lists unconditionally if flag is present
@@ -89,27 +77,14 @@ class AVDH264HalV3(AVDHal):
 			push(x, "hdr_4c_pic_scaling_list_dims")
 
 		if (pps.pic_scaling_matrix_present_flag):
-			for i in range(6):
-				for j in range(16 // 4): # Set unconditionally
-					y = j * 4
-					x = 0
-					x |= pps.pic_scaling_list_4x4[i][y + 0] << 24
-					x |= pps.pic_scaling_list_4x4[i][y + 1] << 16
-					x |= pps.pic_scaling_list_4x4[i][y + 2] << 8
-					x |= pps.pic_scaling_list_4x4[i][y + 3] << 0
-					push(x, "scl_46c_pic_scaling_matrix_4x4", i*(16 // 4) + j)
+			# Set unconditionally
+			self.push_words(pack_scaling_lists(pps.pic_scaling_list_4x4).ravel(), "scl_46c_pic_scaling_matrix_4x4")
 
 			if (pps.transform_8x8_mode_flag):
+				words_8x8 = pack_scaling_lists(pps.pic_scaling_list_8x8)
 				for i in range(6):
 					if (pps.pic_scaling_list_present_flag[i + 6]):
-						for j in range(64 // 4):
-							y = j * 4
-							x = 0
-							x |= pps.pic_scaling_list_8x8[i][y + 0] << 24
-							x |= pps.pic_scaling_list_8x8[i][y + 1] << 16
-							x |= pps.pic_scaling_list_8x8[i][y + 2] << 8
-							x |= pps.pic_scaling_list_8x8[i][y + 3] << 0
-							push(x, "scl_4cc_pic_scaling_matrix_8x8", i*(64 // 4) + j)
+						self.push_words(words_8x8[i], "scl_4cc_pic_scaling_matrix_8x8", i*(64 // 4))
 			else:
 				default_8x8_intra_scaling_list = [
 					0x060a0d10, 0x0a0b1012, 0x0d101217, 0x10121719,
@@ -128,21 +103,11 @@ class AVDH264HalV3(AVDHal):
 				for i in range(len(default_8x8_inter_scaling_list)):
 					push(default_8x8_inter_scaling_list[i], "scl_4cc_pic_scaling_matrix_8x8", i)
 
-	def set_header(self, ctx, sl):
+	def set_header_sps(self, ctx, sl):
 		push = self.push
 		sps = ctx.get_sps(sl)
 		pps = ctx.get_pps(sl)
 
-		assert((ctx.inst_fifo_idx >= 0) and (ctx.inst_fifo_idx <= ctx.inst_fifo_count))
-		push(0x2b000000 | 0x100 | (ctx.inst_fifo_idx * 0x10), "cm3_cmd_inst_fifo_start")
-		# ---- FW BP -----
-
-		x = 0x1000
-		if (sl.nal_unit_type == H264_NAL_SLICE_IDR):
-			x |= 0x2000
-		x |= 0x2e0
-		push(0x2db00000 | x, "hdr_34_cmd_start_hdr")
-
 		push(0x1000000, "hdr_38_mode")
 		push((((ctx.height - 1) & 0xffff) << 16) | ((ctx.width - 1) & 0xffff), "hdr_3c_height_width")
 		push(0x0, "hdr_40_zero")
@@ -156,12 +121,9 @@ class AVDH264HalV3(AVDHal):
 		x |= boolify(sps.direct_8x8_inference_flag)
 		push(x, "hdr_2c_sps_param")
 
-		x = 0
-		if (pps.entropy_coding_mode_flag):
-			x |= set_bit(20)
-		if (sl.nal_unit_type != H264_NAL_SLICE_IDR):
-			x |= set_bit(21)
-		push(x, "hdr_44_flags")
+	def set_header_pps(self, ctx, sl):
+		push = self.push
+		pps = ctx.get_pps(sl)
 
 		x = swrap(pps.chroma_qp_index_offset, 32) << 5 | swrap(pps.second_chroma_qp_index_offset, 32)
 		push(x, "hdr_48_chroma_qp_index_offset")
@@ -180,10 +142,8 @@ class AVDH264HalV3(AVDHal):
 		push(ctx.pps_tile_addrs[3] >> 8, "hdr_9c_pps_tile_addr_lsb8", 3)
 		push(0x70007, "cm3_dma_config_5")
 
-		push((sl.pic.addr + ctx.rvra_offset(0)) >> 7, "hdr_c0_curr_ref_addr_lsb7", 0)
-		push((sl.pic.addr + ctx.rvra_offset(1)) >> 7, "hdr_c0_curr_ref_addr_lsb7", 1)
-		push((sl.pic.addr + ctx.rvra_offset(2)) >> 7, "hdr_c0_curr_ref_addr_lsb7", 2)
-		push((sl.pic.addr + ctx.rvra_offset(3)) >> 7, "hdr_c0_curr_ref_addr_lsb7", 3)
+	def set_header_layout(self, ctx, sl):
+		push = self.push
 
 		push(ctx.y_addr >> 8, "hdr_210_y_addr_lsb8")
 		push(ctx.fmt.in_width >> 4, "hdr_218_width_align")
@@ -192,10 +152,45 @@ class AVDH264HalV3(AVDHal):
 		push(0x0, "cm3_mark_end_section")
 		push((((ctx.height - 1) & 0xffff) << 16) | ((ctx.width - 1) & 0xffff), "hdr_54_height_width")
 
+	def set_header(self, ctx, sl):
+		# Only the slice/ref dependent words are computed here per frame;
+		# the rest is replayed from per-SPS/PPS templates
+		push = self.push
+		sps = ctx.get_sps(sl)
+		pps = ctx.get_pps(sl)
+
+		assert((ctx.inst_fifo_idx >= 0) and (ctx.inst_fifo_idx <= ctx.inst_fifo_count))
+		push(0x2b000000 | 0x100 | (ctx.inst_fifo_idx * 0x10), "cm3_cmd_inst_fifo_start")
+		# ---- FW BP -----
+
+		x = 0x1000
+		if (sl.nal_unit_type == H264_NAL_SLICE_IDR):
+			x |= 0x2000
+		x |= 0x2e0
+		push(0x2db00000 | x, "hdr_34_cmd_start_hdr")
+
+		self.push_template(self.set_header_sps, ctx, sl, sps, pps)
+
+		x = 0
+		if (pps.entropy_coding_mode_flag):
+			x |= set_bit(20)
+		if (sl.nal_unit_type != H264_NAL_SLICE_IDR):
+			x |= set_bit(21)
+		push(x, "hdr_44_flags")
+
+		self.push_template(self.set_header_pps, ctx, sl, pps)
+
+		push((sl.pic.addr + ctx.rvra_offset(0)) >> 7, "hdr_c0_curr_ref_addr_lsb7", 0)
+		push((sl.pic.addr + ctx.rvra_offset(1)) >> 7, "hdr_c0_curr_ref_addr_lsb7", 1)
+		push((sl.pic.addr + ctx.rvra_offset(2)) >> 7, "hdr_c0_curr_ref_addr_lsb7", 2)
+		push((sl.pic.addr + ctx.rvra_offset(3)) >> 7, "hdr_c0_curr_ref_addr_lsb7", 3)
+
+		self.push_template(self.set_header_layout, ctx, sl)
+
 		if (sl.nal_unit_type != H264_NAL_SLICE_IDR):
 			self.set_refs(ctx, sl)
 
-		self.set_scaling_list(ctx, sl)
+		self.push_template(self.set_scaling_list, ctx, sl, sps, pps)
 		# ---- FW BP -----
 
 	def set_weights(self, ctx, sl):
@@ -183,10 +183,23 @@ class AVDH264RLM:
 
 		return cand
 
+	def bump_frames(self):
+		ctx = self.ctx
+		# C.4.5.3: output as soon as the reorder window or the DPB is exceeded
+		while (len(ctx.output_list)):
+			refs = [pic.access_idx for pic in ctx.dpb_list]
+			fullness = len(refs) + len([x for x in ctx.output_list if x.access_idx not in refs])
+			if ((len(ctx.output_list) <= ctx.max_num_reorder) and (fullness <= ctx.max_dec_frame_buffering)):
+				break
+			self.dec.bump_output()
+
 	def init_slice(self):
 		ctx = self.ctx; sl = self.ctx.active_sl
 		sps = ctx.get_sps(sl)
 
+		if (sl.nal_unit_type == H264_NAL_SLICE_IDR):
+			self.dec.flush_output(discard=sl.no_output_of_prior_pics_flag)
+
 		sl.pic = self.get_free_pic()
 		sl.pic.flags |= H264_FRAME_FLAG_OUTPUT
 		sl.pic.sps_pic = self.get_free_sps_pic()
@@ -301,3 +314,6 @@ class AVDH264RLM:
 
 		ctx.prev_poc_lsb = sl.pic_order_cnt_lsb
 		ctx.prev_poc_msb = ctx.poc_msb
+
+		self.dec.queue_output(sl.pic, sl)
+		self.bump_frames()
@@ -50,6 +50,7 @@ class AVDH265Decoder(AVDDecoder):
 		ctx.ref_lst = [[None for n in range(64)] for n in range(5)]
 		ctx.ref_lst_cnt = [0, 0, 0, 0, 0]
 		ctx.poc = -1
+		ctx.output_list = []
 		self.rlm.ctx = ctx
 
 	def refresh_sps(self, sl):
@@ -158,6 +159,8 @@ class AVDH265Decoder(AVDDecoder):
 		for seg in sl.slices:
 			size += len(seg.get_payload())
 		if (size > ctx.slice_data_size):
+			if (self.perf):
+				self.perf.count("slice_data_realloc")
 			self.range_free(name="slice_data")
 			ctx.slice_data_addr = self.range_alloc(size, align=0x4000, name="slice_data")
 			ctx.slice_data_size = size
@@ -171,8 +174,20 @@ class AVDH265Decoder(AVDDecoder):
 		self.refresh_sps(sl)
 		self.realloc_rbsp_size(sl)
 
+	def get_pio_header(self):
+		sl = self.ctx.active_sl
+		return {
+			"pio_piodma1_word": 0x221ef15,
+			"pio_4_codec": 0,
+			"pio_14_deadcafe": 0xdeadcafe,
+			"pio_18_101_notused": 0x101,
+			"pio_1c_num_entry_points": sum([x.num_entry_point_offsets + 1 for x in [sl] + sl.slices]),
+			"pio_20_piodma2_cmd": 0x34ce4,
+			"pio_24_piodma3_cmd": 0x4ace4,
+		}
+
 	def setup(self, path, num=0, **kwargs):
-		vps_list, sps_list, pps_list, slices = self.parser.parse(path, num=num)
+		vps_list, sps_list, pps_list, slices = self.timed("parse", self.parser.parse, path, num=num)
 		self.new_context(vps_list, sps_list, pps_list)
 		return slices
 
@@ -194,4 +209,5 @@ class AVDH265Decoder(AVDDecoder):
 		if (IS_IDR2(sl)):
 			ctx.last_intra_nal_type = sl.nal_unit_type
 		ctx.last_intra = IS_INTRA(sl)
+		self.rlm.output_frame(sl)
 		ctx.access_idx += 1
@@ -140,10 +140,14 @@ class AVDH265V3Input(AVDFrameParams):
 		"pad" / Padding(0x34ce0 - 0xbe0),
 		"inp" / RepeatUntil(lambda obj,lst,ctx: lst[-1].til_0_pio_src_addr == 0, AVDH265V3InputTile),
 	)
+	_counts = {"inp": (0x4ace4 - 0x34ce4) // 0x2c}  # piodma2 up to piodma3
 	def __init__(self):
 		super().__init__()
 
 class AVDH265V3FakeFrameParams(AVDFakeFrameParams):
+	# no slot known for the SPS tile address in the H.265 layout
+	nofp_prefixes = ("cm3_", "hdr_bc_sps_tile_addr_lsb8")
+
 	def __init__(self):
 		super().__init__()
 
@@ -184,6 +188,7 @@ class AVDH265V3FrameParams(AVDFrameParams):
 		"inp" / AVDH265V3Input,
 	)
 	_ffpcls = AVDH265V3FakeFrameParams
+	_size = 0xb8000  # one DART1 FIFO slot
 	_reprkeys = ["pio", "hdr", "scl", "slc", "inp"]
 	def __init__(self):
 		super().__init__()
@@ -2,7 +2,7 @@
 # SPDX-License-Identifier: MIT
 # Copyright 2023 Eileen Yoon <eyn@gmx.com>
 
-from ..hal import AVDHal
+from ..hal import AVDHal, pack_scaling_lists
 from ..utils import *
 from .types import *
 
@@ -22,49 +22,25 @@ class AVDH265HalV3(AVDHal):
 				push(x, "hdr_%x_sps_scl_delta_coeff" % (0x3c + (i*2 + j)*4) if is_sps
 						else "hdr_%x_pps_scl_delta_coeff" % (0x80 + (i*2 + j)*4))
 
-		for i in range(6): # 4x4: transposed in stride 4
+		words_4x4 = pack_scaling_lists(list_4x4, 4) # 4x4: transposed in stride 4
+		for i in range(6):
 			if (mask & (1 << (0*6 + i))):
-				for j in range(16 // 4):
-					x = 0
-					x |= list_4x4[i][j + 0*4] << 24
-					x |= list_4x4[i][j + 1*4] << 16
-					x |= list_4x4[i][j + 2*4] << 8
-					x |= list_4x4[i][j + 3*4] << 0
-					push(x, "scl_22c_seq_scaling_matrix_4x4" if is_sps else "scl_610_pic_scaling_matrix_4x4", i*(16 // 4) + j)
-
-		for i in range(6): # 8x8: transposed in stride 8
+				self.push_words(words_4x4[i], "scl_22c_seq_scaling_matrix_4x4" if is_sps else "scl_610_pic_scaling_matrix_4x4", i*(16 // 4))
+
+		words_8x8 = pack_scaling_lists(list_8x8, 8) # 8x8: transposed in stride 8
+		for i in range(6):
 			if (mask & (1 << (1*6 + i))):
-				for j in range(2):
-					for k in range(8):
-						x = 0
-						x |= list_8x8[i][j*32 + k + 0*8] << 24
-						x |= list_8x8[i][j*32 + k + 1*8] << 16
-						x |= list_8x8[i][j*32 + k + 2*8] << 8
-						x |= list_8x8[i][j*32 + k + 3*8] << 0
-						push(x, "scl_28c_seq_scaling_matrix_8x8" if is_sps else "scl_670_pic_scaling_matrix_8x8", i*(64 // 4) + j*8 + k)
-
-		for i in range(6): # 16x16: transposed in stride 8
+				self.push_words(words_8x8[i], "scl_28c_seq_scaling_matrix_8x8" if is_sps else "scl_670_pic_scaling_matrix_8x8", i*(64 // 4))
+
+		words_16x16 = pack_scaling_lists(list_16x16, 8) # 16x16: transposed in stride 8
+		for i in range(6):
 			if (mask & (1 << (2*6 + i))):
-				for j in range(2):
-					for k in range(8):
-						x = 0
-						x |= list_16x16[i][j*32 + k + 0*8] << 24
-						x |= list_16x16[i][j*32 + k + 1*8] << 16
-						x |= list_16x16[i][j*32 + k + 2*8] << 8
-						x |= list_16x16[i][j*32 + k + 3*8] << 0
-						push(x, "scl_40c_seq_scaling_matrix_16x16" if is_sps else "scl_7f0_pic_scaling_matrix_16x16", i*(64 // 4) + j*8 + k)
-
-		for i in range(6): # 32x32: transposed in stride 8
-			if (i not in [0, 3]): continue
+				self.push_words(words_16x16[i], "scl_40c_seq_scaling_matrix_16x16" if is_sps else "scl_7f0_pic_scaling_matrix_16x16", i*(64 // 4))
+
+		words_32x32 = pack_scaling_lists(list_32x32[0::3], 8) # 32x32: transposed in stride 8, only 0 and 3
+		for i in [0, 3]:
 			if (mask & (1 << (3*6 + i))):
-				for j in range(2):
-					for k in range(8):
-						x = 0
-						x |= list_32x32[i][j*32 + k + 0*8] << 24
-						x |= list_32x32[i][j*32 + k + 1*8] << 16
-						x |= list_32x32[i][j*32 + k + 2*8] << 8
-						x |= list_32x32[i][j*32 + k + 3*8] << 0
-						push(x, "scl_58c_seq_scaling_matrix_32x32" if is_sps else "scl_970_pic_scaling_matrix_32x32", boolify(i)*(64 // 4) + j*8 + k)
+				self.push_words(words_32x32[boolify(i)], "scl_58c_seq_scaling_matrix_32x32" if is_sps else "scl_970_pic_scaling_matrix_32x32", boolify(i)*(64 // 4))
 
 	def set_scaling_lists(self, ctx, sl):
 		push = self.push
@@ -131,11 +107,22 @@ class AVDH265HalV3(AVDHal):
 			push((pic.addr + ctx.rvra_offset(2)) >> 7, "hdr_174_ref2_addr_lsb7", n)
 			push((pic.addr + ctx.rvra_offset(3)) >> 7, "hdr_194_ref3_addr_lsb7", n)
 
-	def set_flags(self, ctx, sl):
+	def set_header_sps(self, ctx, sl):
 		push = self.push
 		sps = ctx.get_sps(sl)
-		pps = ctx.get_pps(sl)
-		log2_ctb_size = sps.log2_min_cb_size + sps.log2_diff_max_min_coding_block_size
+
+		push(0x0000000, "hdr_50_mode")
+		push((((ctx.height - 1) & 0xffff) << 16) | ((ctx.width - 1) & 0xffff), "hdr_54_height_width")
+		push(0x0, "hdr_58_pixfmt_zero")
+		push((((ctx.height - 1) >> 3) << 16) | ((ctx.width - 1) >> 3), "hdr_28_height_width_shift3")
+
+		x = sps.chroma_format_idc << 24
+		x |= sps.log2_diff_max_min_coding_block_size << 11
+		x |= sps.log2_diff_max_min_transform_block_size << 7
+		x |= sps.max_transform_hierarchy_depth_inter << 4
+		x |= sps.max_transform_hierarchy_depth_intra << 1
+		x |= sps.amp_enabled_flag
+		push(x, "hdr_2c_sps_txfm")
 
 		x = 0
 		if (sps.pcm_enabled_flag):
@@ -152,6 +139,12 @@ class AVDH265HalV3(AVDHal):
 			x |= set_bit(9)
 		push(x, "hdr_34_sps_flags")
 
+	def set_pps_flags(self, ctx, sl):
+		push = self.push
+		sps = ctx.get_sps(sl)
+		pps = ctx.get_pps(sl)
+		log2_ctb_size = sps.log2_min_cb_size + sps.log2_diff_max_min_coding_block_size
+
 		x = 0
 		x |= (log2_ctb_size - 3) << 3
 		x |= (pps.log2_parallel_merge_level - 2) << 9
@@ -174,6 +167,10 @@ class AVDH265HalV3(AVDHal):
 			x |= set_bit(21)
 		push(x, "hdr_5c_pps_flags")
 
+	def set_header_pps(self, ctx, sl):
+		push = self.push
+		pps = ctx.get_pps(sl)
+
 		x = swrap(pps.pps_cb_qp_offset, 1 << 5) << 5 | swrap(pps.pps_cr_qp_offset, 1 << 5)
 		push(x, "hdr_60_pps_qp")
 
@@ -184,35 +181,6 @@ class AVDH265HalV3(AVDHal):
 		push(0, "hdr_74_zero")
 		push(0, "hdr_78_zero")
 
-	def set_header(self, ctx, sl):
-		push = self.push
-		sps = ctx.get_sps(sl)
-		pps = ctx.get_pps(sl)
-
-		assert((ctx.inst_fifo_idx >= 0) and (ctx.inst_fifo_idx <= ctx.inst_fifo_count))
-		push(0x2b000000 | 0x100 | (ctx.inst_fifo_idx * 0x10), "cm3_cmd_inst_fifo_start")
-		# ---- FW BP -----
-
-		x = 0x1000
-		if (IS_INTRA(sl)):
-			x |= 0x2000
-		x |= 0x2e0
-		push(0x2db00000 | x, "hdr_4c_cmd_start_hdr")
-
-		push(0x0000000, "hdr_50_mode")
-		push((((ctx.height - 1) & 0xffff) << 16) | ((ctx.width - 1) & 0xffff), "hdr_54_height_width")
-		push(0x0, "hdr_58_pixfmt_zero")
-		push((((ctx.height - 1) >> 3) << 16) | ((ctx.width - 1) >> 3), "hdr_28_height_width_shift3")
-
-		x = sps.chroma_format_idc << 24
-		x |= sps.log2_diff_max_min_coding_block_size << 11
-		x |= sps.log2_diff_max_min_transform_block_size << 7
-		x |= sps.max_transform_hierarchy_depth_inter << 4
-		x |= sps.max_transform_hierarchy_depth_intra << 1
-		x |= sps.amp_enabled_flag
-		push(x, "hdr_2c_sps_txfm")
-
-		self.set_flags(ctx, sl)
 		push(0x300000, "hdr_98_const_30")
 		push(0x4020002, "cm3_dma_config_1")
 		push(0x20002, "cm3_dma_config_2")
@@ -237,12 +205,9 @@ class AVDH265HalV3(AVDHal):
 			push(0x0, "hdr_dc_pps_tile_addr_lsb8", 9)
 
 		push(0x70007, "cm3_dma_config_5")
-		x = sl.pic.addr
-		push((x + ctx.rvra_offset(0)) >> 7, "hdr_104_curr_ref_addr_lsb7", 0)
-		push((x + ctx.rvra_offset(1)) >> 7, "hdr_104_curr_ref_addr_lsb7", 1)
-		push((x + ctx.rvra_offset(2)) >> 7, "hdr_104_curr_ref_addr_lsb7", 2)
-		push((x + ctx.rvra_offset(3)) >> 7, "hdr_104_curr_ref_addr_lsb7", 3)
-		push(0x0, "cm3_mark_end_section")
+
+	def set_header_layout(self, ctx, sl):
+		push = self.push
 
 		push(ctx.y_addr >> 8, "hdr_1b4_y_addr_lsb8")
 		push(round_up(ctx.width, 64) >> 4, "hdr_1bc_width_align")
@@ -251,10 +216,40 @@ class AVDH265HalV3(AVDHal):
 		push(0x0, "cm3_mark_end_section")
 		push((((ctx.height - 1) & 0xffff) << 16) | ((ctx.width - 1) & 0xffff), "hdr_54_height_width")
 
+	def set_header(self, ctx, sl):
+		# Only the slice/ref dependent words are computed here per frame;
+		# the rest is replayed from per-SPS/PPS templates
+		push = self.push
+		sps = ctx.get_sps(sl)
+		pps = ctx.get_pps(sl)
+
+		assert((ctx.inst_fifo_idx >= 0) and (ctx.inst_fifo_idx <= ctx.inst_fifo_count))
+		push(0x2b000000 | 0x100 | (ctx.inst_fifo_idx * 0x10), "cm3_cmd_inst_fifo_start")
+		# ---- FW BP -----
+
+		x = 0x1000
+		if (IS_INTRA(sl)):
+			x |= 0x2000
+		x |= 0x2e0
+		push(0x2db00000 | x, "hdr_4c_cmd_start_hdr")
+
+		self.push_template(self.set_header_sps, ctx, sl, sps)
+		self.set_pps_flags(ctx, sl)
+		self.push_template(self.set_header_pps, ctx, sl, pps)
+
+		x = sl.pic.addr
+		push((x + ctx.rvra_offset(0)) >> 7, "hdr_104_curr_ref_addr_lsb7", 0)
+		push((x + ctx.rvra_offset(1)) >> 7, "hdr_104_curr_ref_addr_lsb7", 1)
+		push((x + ctx.rvra_offset(2)) >> 7, "hdr_104_curr_ref_addr_lsb7", 2)
+		push((x + ctx.rvra_offset(3)) >> 7, "hdr_104_curr_ref_addr_lsb7", 3)
+		push(0x0, "cm3_mark_end_section")
+
+		self.push_template(self.set_header_layout, ctx, sl)
+
 		if (not IS_INTRA(sl)):
 			self.set_refs(ctx, sl)
 
-		self.set_scaling_lists(ctx, sl)
+		self.push_template(self.set_scaling_lists, ctx, sl, sps, pps)
 
 	def set_weights(self, ctx, sl):
 		push = self.push
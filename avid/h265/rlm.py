@@ -52,13 +52,40 @@ class AVDH265RLM:
 		ctx.dpb_list = dpb_list
 		return reflist
 
-	def bump_frame(self):
+	def need_bumping(self, sps, fullness=-1):
 		ctx = self.ctx
-		dpb = 0
-		for frame in ctx.dpb_list:
-			if (frame.flags and frame.poc != sl.poc):
-				dpb += 1
-		raise ValueError("TODO")
+		if (len(ctx.output_list) > sps.sps_max_num_reorder_pics):
+			return True
+		if (sps.sps_max_latency_increase != -1): # sps_max_latency_increase_plus1 != 0
+			max_latency = sps.sps_max_num_reorder_pics + sps.sps_max_latency_increase
+			if any(x.latency >= max_latency for x in ctx.output_list):
+				return True
+		return fullness >= sps.sps_max_dec_pic_buffering
+
+	def bump_frame(self, sl):
+		ctx = self.ctx
+		sps = ctx.get_sps(sl)
+		# C.5.2.2: make room in the DPB before the current picture is decoded
+		while (len(ctx.output_list)):
+			refs = [pic.access_idx for pic in ctx.dpb_pool if (pic.flags & (HEVC_FRAME_FLAG_SHORT_REF | HEVC_FRAME_FLAG_LONG_REF)) and (pic.idx != sl.pic.idx)]
+			fullness = len(refs) + len([x for x in ctx.output_list if x.access_idx not in refs])
+			if (not self.need_bumping(sps, fullness)):
+				break
+			self.dec.bump_output()
+
+	def output_frame(self, sl):
+		ctx = self.ctx
+		sps = ctx.get_sps(sl)
+		# C.5.2.3: current picture is in, output as soon as reordering allows.
+		# PicLatencyCount only ticks for waiting pictures that follow the
+		# current one in output order
+		if (sl.pic_output_flag):
+			for x in ctx.output_list:
+				if (x.poc > sl.pic.poc):
+					x.latency += 1
+			self.dec.queue_output(sl.pic, sl)
+		while (len(ctx.output_list) and self.need_bumping(sps)):
+			self.dec.bump_output()
 
 	def find_ref_idx(self, poc):
 		ctx = self.ctx
@@ -79,7 +106,12 @@ class AVDH265RLM:
 		ctx = self.ctx
 		pic = self.get_free_pic()
 		pic.flags = 0
-		raise ValueError("TODO")
+		pic.type = HEVC_REF_LT if (t == LT_CURR or t == LT_FOLL) else HEVC_REF_ST
+		pic.poc = poc
+		pic.rasl = 0
+		pic.access_idx = ctx.access_idx
+		self.log(f"Generating missing ref: {pic}")
+		return pic
 
 	def add_candidate_ref(self, t, poc, flags):
 		ctx = self.ctx
@@ -119,8 +151,11 @@ class AVDH265RLM:
 				ref.poc = sl.st_rps_poc[i]
 				ref.flags &= ~(HEVC_FRAME_FLAG_OUTPUT)
 
-		if (not IS_IRAP(sl)):
-			self.bump_frame()
+		if (IS_IRAP(sl) and (IS_IDR(sl) or IS_BLA(sl) or ctx.access_idx == 0)):
+			# NoRaslOutputFlag: prior pictures are flushed (or dropped) in one go
+			self.dec.flush_output(discard=sl.no_output_of_prior_pics_flag)
+		else:
+			self.bump_frame(sl)
 
 	def set_new_ref(self, sl, poc):
 		ctx = self.ctx
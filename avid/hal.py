@@ -2,8 +2,11 @@
 # SPDX-License-Identifier: MIT
 # Copyright 2023 Eileen Yoon <eyn@gmx.com>
 
+import sys
+from array import array
 from collections import namedtuple
 from .utils import *
+import numpy as np
 
 class AVDInst(namedtuple('AVDInst', ['val', 'name', 'pos', 'idx'])):
 	def get_disp_name(self):
@@ -30,27 +33,158 @@ class AVDInst(namedtuple('AVDInst', ['val', 'name', 'pos', 'idx'])):
 	def __repr__(self):
 		return self.rep()
 
+def pack_scaling_lists(lists, stride=0):
+	# Pack u8 scaling lists MSB-first four to a u32, for all lists at once.
+	# With a stride, each word takes a column of a 4 x stride block instead
+	# i.e. the transposed layout. Returns one row of words per list.
+	a = np.asarray(lists, dtype=np.uint32)
+	if (stride):
+		a = a.reshape(a.shape[0], -1, 4, stride).transpose(0, 1, 3, 2)
+	a = a.reshape(a.shape[0], -1, 4)
+	return (a[..., 0] << 24) | (a[..., 1] << 16) | (a[..., 2] << 8) | a[..., 3]
+
+class AVDInstStream:
+	# u32 words + interned name IDs + indices in flat arrays instead of a
+	# namedtuple per word. AVDInst views are only built when looked at.
+	_names = [""]  # ID 0 is unnamed, shown as unk_<pos>
+	_name_ids = {"": 0}
+
+	def __init__(self):
+		self.vals = array('I')
+		self.name_ids = array('H')
+		self.idxs = array('i')  # -1 for scalars
+
+	@classmethod
+	def intern(cls, name):
+		nid = cls._name_ids.get(name)
+		if (nid == None):
+			nid = len(cls._names)
+			cls._names.append(name)
+			cls._name_ids[name] = nid
+		return nid
+
+	def push_words(self, vals, name, idx):
+		self.vals.extend(vals)
+		self.name_ids.extend([self.intern(name)] * len(vals))
+		self.idxs.extend(range(idx, idx + len(vals)))
+
+	def push(self, val, name="", idx=None):
+		self.vals.append(val)
+		self.name_ids.append(self.intern(name) if name else 0)
+		self.idxs.append(-1 if idx == None else idx)
+
+	def extend(self, other):
+		self.vals.extend(other.vals)
+		self.name_ids.extend(other.name_ids)
+		self.idxs.extend(other.idxs)
+
+	def tail(self, start):
+		stream = AVDInstStream()
+		stream.vals = self.vals[start:]
+		stream.name_ids = self.name_ids[start:]
+		stream.idxs = self.idxs[start:]
+		return stream
+
+	def get_name(self, pos):
+		nid = self.name_ids[pos]
+		return self._names[nid] if nid else f"unk_{pos}"
+
+	def get_idx(self, pos):
+		idx = self.idxs[pos]
+		return None if idx < 0 else idx
+
+	def items(self):
+		# (val, name, idx) without building AVDInsts, for make_ffp
+		names = self._names
+		for pos,(val, nid, idx) in enumerate(zip(self.vals, self.name_ids, self.idxs)):
+			yield val, (names[nid] if nid else f"unk_{pos}"), (None if idx < 0 else idx)
+
+	def match_names(self, names):
+		# bool per word, True if its name is one of names
+		ids = [self._name_ids[name] for name in names if name in self._name_ids]
+		return np.isin(np.frombuffer(self.name_ids, dtype=np.uint16), ids)
+
+	def tobytes(self):
+		# FIFO words are little-endian
+		if (sys.byteorder == "little"):
+			return self.vals.tobytes()
+		vals = array('I', self.vals)
+		vals.byteswap()
+		return vals.tobytes()
+
+	def __len__(self):
+		return len(self.vals)
+
+	def __getitem__(self, pos):
+		if isinstance(pos, slice):
+			return [self[n] for n in range(*pos.indices(len(self)))]
+		if (pos < 0):
+			pos += len(self)
+		return AVDInst(self.vals[pos], self.get_name(pos), pos, self.get_idx(pos))
+
+	def __iter__(self):
+		for pos in range(len(self)):
+			yield self[pos]
+
+	def __repr__(self):
+		return "\n".join(repr(inst) for inst in self)
+
 class AVDHal:
 	def __init__(self):
-		self.inst_stream = []
+		self.inst_stream = AVDInstStream()
 		self.stfu = False
+		self.use_templates = True
+		self.templates = {}
+		self.perf = None
 
 	def log(self, x):
 		if (not self.stfu):
 			print(f"[AVD] {x}")
 
 	def push(self, val, name="", idx=None):
-		if not name:
-			name = f"unk_{str(len(self.inst_stream))}"
-		inst = AVDInst(val, name, len(self.inst_stream), idx)
-		self.log(inst)
 		assert(val >= 0)
-		self.inst_stream.append(inst)
+		self.inst_stream.push(val, name, idx)
+		if (not self.stfu):
+			self.log(self.inst_stream[-1])
+
+	def reset_templates(self):
+		self.templates = {}
+
+	def push_template(self, fn, ctx, sl, *deps):
+		# fn only reads deps (parameter sets) and the buffer layout, so its
+		# words are recorded once and replayed on every later frame. Keying
+		# on id() is safe since the entry keeps deps alive. The caller must
+		# reset_templates() when the layout changes.
+		if (not self.use_templates):
+			fn(ctx, sl)
+			return
+		key = (fn.__name__,) + tuple(id(dep) for dep in deps)
+		tmpl = self.templates.get(key)
+		if (self.perf):
+			self.perf.count("hal_template_miss" if tmpl == None else "hal_template_hit")
+		if (tmpl == None):
+			start = len(self.inst_stream)
+			fn(ctx, sl)
+			self.templates[key] = (deps, self.inst_stream.tail(start))
+			return
+		start = len(self.inst_stream)
+		self.inst_stream.extend(tmpl[1])
+		if (not self.stfu):
+			for pos in range(start, len(self.inst_stream)):
+				self.log(self.inst_stream[pos])
+
+	def push_words(self, vals, name, idx=0):
+		# vals is a run of words for consecutive idx of one array field
+		start = len(self.inst_stream)
+		self.inst_stream.push_words(vals.tolist() if isinstance(vals, np.ndarray) else vals, name, idx)
+		if (not self.stfu):
+			for pos in range(start, len(self.inst_stream)):
+				self.log(self.inst_stream[pos])
 
 	def set_insn(self, ctx, sl):
 		raise ValueError()
 
 	def decode(self, ctx, sl):
-		self.inst_stream = []
+		self.inst_stream = AVDInstStream()
 		self.set_insn(ctx, sl)
 		return self.inst_stream
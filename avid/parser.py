@@ -7,6 +7,7 @@ import re
 import struct
 from collections import namedtuple
 from pathlib import Path
+from time import perf_counter
 from wurlitzer import pipes
 from .utils import dotdict
 
@@ -61,6 +62,7 @@ class AVDParser:
 			self.lib = ctypes.cdll.LoadLibrary(lib_path)
 		self.arr_keys = []
 		self.slccls = AVDSlice
+		self.tracer = None
 
 	def parse_headers(self, stdout):
 		# Yes we capture header fields from C-level stdout. This avoids the
@@ -71,7 +73,10 @@ class AVDParser:
 		assert(len(start) == len(end))
 
 		units = []
+		tracer = self.tracer
 		for i,(start, end) in enumerate(list(zip(start, end))):
+			if (tracer):
+				t = perf_counter()
 			group = lines[start:end]
 
 			unit = self.slccls()
@@ -109,6 +114,8 @@ class AVDParser:
 				else:
 					unit[key] = val
 			units.append(unit)
+			if (tracer):
+				tracer.span("parse NAL", t, perf_counter(), cat="parser", unit=i, nal_unit_type=unit.get("nal_unit_type"))
 
 		return units
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright 2023 Eileen Yoon <eyn@gmx.com>
+
+import json
+import os
+import time
+
+class AVDStats:
+	# Opt-in decoder counters. Disabled decoders hold None instead of one of
+	# these, so the only cost when off is a truthiness check per frame.
+	def __init__(self, path="", interval=10.0, fmt=""):
+		self.path = path
+		self.interval = interval
+		if (not fmt):
+			fmt = "prom" if path.endswith((".prom", ".txt")) else "json"
+		self.fmt = fmt
+		self.reset()
+
+	def reset(self):
+		self.start = time.time()
+		self.next_dump = time.perf_counter() + self.interval
+		self.times = {}   # stage -> cumulative seconds
+		self.calls = {}   # stage -> call count
+		self.counters = {}
+		self.gauges = {}  # name -> [last, max]
+		self.frames = 0
+		self.inst_words = 0
+		self.inst_words_max = 0
+
+	def add_time(self, stage, dt):
+		self.times[stage] = self.times.get(stage, 0.0) + dt
+		self.calls[stage] = self.calls.get(stage, 0) + 1
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def gauge(self, name, val):
+		g = self.gauges.get(name)
+		if (g is None):
+			self.gauges[name] = [val, val]
+		else:
+			g[0] = val
+			g[1] = max(g[1], val)
+
+	def add_frame(self, words):
+		self.frames += 1
+		self.inst_words += words
+		self.inst_words_max = max(self.inst_words_max, words)
+		if (self.path and time.perf_counter() >= self.next_dump):
+			self.dump()
+
+	def get(self):
+		stages = {}
+		for stage, t in self.times.items():
+			stages[stage] = {"time": t, "calls": self.calls[stage], "mean_ms": t / self.calls[stage] * 1e3}
+		return {
+			"uptime": time.time() - self.start,
+			"frames": self.frames,
+			"stages": stages,
+			"inst_words": {"total": self.inst_words, "max": self.inst_words_max,
+				"mean": self.inst_words / self.frames if self.frames else 0.0},
+			"counters": dict(self.counters),
+			"gauges": {name: {"value": g[0], "max": g[1]} for name, g in self.gauges.items()},
+		}
+
+	def to_json(self):
+		return json.dumps(self.get())
+
+	def to_prometheus(self, prefix="avd"):
+		def line(name, val, label=""):
+			return "%s_%s%s %s" % (prefix, name, "{%s}" % (label) if label else "", repr(val))
+		out = []
+		out.append("# TYPE %s_frames_total counter" % (prefix))
+		out.append(line("frames_total", self.frames))
+		out.append("# TYPE %s_stage_seconds_total counter" % (prefix))
+		for stage, t in self.times.items():
+			out.append(line("stage_seconds_total", t, 'stage="%s"' % (stage)))
+		out.append("# TYPE %s_stage_calls_total counter" % (prefix))
+		for stage, n in self.calls.items():
+			out.append(line("stage_calls_total", n, 'stage="%s"' % (stage)))
+		out.append("# TYPE %s_inst_words_total counter" % (prefix))
+		out.append(line("inst_words_total", self.inst_words))
+		out.append("# TYPE %s_inst_words_max gauge" % (prefix))
+		out.append(line("inst_words_max", self.inst_words_max))
+		for name, n in self.counters.items():
+			out.append("# TYPE %s_%s_total counter" % (prefix, name))
+			out.append(line("%s_total" % (name), n))
+		for name, g in self.gauges.items():
+			out.append("# TYPE %s_%s gauge" % (prefix, name))
+			out.append(line(name, g[0]))
+			out.append("# TYPE %s_%s_max gauge" % (prefix, name))
+			out.append(line("%s_max" % (name), g[1]))
+		return "\n".join(out) + "\n"
+
+	def dump(self, path=""):
+		# Atomic replace so scrapers never see a partial file
+		path = path if path else self.path
+		s = self.to_prometheus() if self.fmt == "prom" else self.to_json() + "\n"
+		with open(path + ".tmp", "w") as f:
+			f.write(s)
+		os.replace(path + ".tmp", path)
+		self.next_dump = time.perf_counter() + self.interval
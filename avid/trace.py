@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright 2023 Eileen Yoon <eyn@gmx.com>
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+class AVDTracer:
+	# Chrome trace-event JSON, open in ui.perfetto.dev or chrome://tracing.
+	# Times are perf_counter() seconds; on Linux that's CLOCK_MONOTONIC, so
+	# spans measured in worker processes line up with the parent's.
+	def __init__(self, path="", name=""):
+		self.path = path
+		self.events = []
+		self.pid = os.getpid()
+		self.lock = threading.Lock()
+		if (name):
+			self.meta("process_name", name)
+
+	def meta(self, key, name, pid=None, tid=None):
+		ev = {"ph": "M", "name": key, "pid": pid if pid else self.pid, "args": {"name": name}}
+		if (tid is not None):
+			ev["tid"] = tid
+		with self.lock:
+			self.events.append(ev)
+
+	def span(self, name, start, end, cat="", pid=None, tid=None, **args):
+		ev = {"ph": "X", "name": name, "cat": cat, "ts": start * 1e6, "dur": (end - start) * 1e6,
+			"pid": pid if pid else self.pid, "tid": tid if tid else threading.get_native_id()}
+		if (args):
+			ev["args"] = args
+		with self.lock:
+			self.events.append(ev)
+
+	@contextmanager
+	def region(self, name, cat="", **args):
+		t = perf_counter()
+		try:
+			yield
+		finally:
+			self.span(name, t, perf_counter(), cat, **args)
+
+	def save(self, path=""):
+		path = path if path else self.path
+		with open(path, "w") as f:
+			json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
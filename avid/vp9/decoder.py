@@ -117,12 +117,29 @@ class AVDVP9Decoder(AVDDecoder):
 		# plus a page for some reason
 		ctx.probs_addr = ctx.probs_base_addr + (probs_slot * (round_up(ctx.probs_size, 0x4000) + 0x4000))
 
+	def get_pio_header(self):
+		return {
+			"pio_piodma1_word": 0x209ef15,
+			"pio_4_codec": 2,
+			"pio_c_piodma2_offset": 0x24aa4,
+			"pio_14_deadcafe": 0xdeadcafe,
+			"pio_18_101_notused": 0x101,
+			"pio_1c_slice_count": 0,
+			"pio_20_piodma1_cmd": 0xaa4,
+		}
+
 	def setup(self, path, num=0, do_probs=1, **kwargs):
 		self.new_context()
-		slices = self.parser.parse(path, num, do_probs)
+		slices = self.timed("parse", self.parser.parse, path, num, do_probs)
 		self.refresh(slices[0])
 		return slices
 
+	def get_dpb_size(self):
+		return len([fb for fb in self.ctx.frame_bufs if fb.ref_count > 0])
+
+	def get_slice_type(self, sl):
+		return "K" if sl.frame_type == VP9_FRAME_TYPE_KEY else "F"
+
 	def get_free_fb(self):
 		ctx = self.ctx; sl = self.ctx.active_sl
 		n = 0
@@ -172,6 +172,7 @@ class AVDVP9V3FrameParams(AVDFrameParams):
 		"til" / AVDVP9V3Tiles,
 	)
 	_ffpcls = AVDVP9V3FakeFrameParams
+	_size = 0xb8000  # one DART1 FIFO slot
 	_reprkeys = ["pio", "hdr", "til"]
 	def __init__(self):
 		super().__init__()
@@ -40,7 +40,7 @@ class AVDVP9Probs(ProbsConstructClass):
 		"tx8p" / Array(2, (Array(1, Int8ul))),
 		"tx16p" / Array(2, (Array(2, Int8ul))),
 		"tx32p" / Array(2, (Array(3, Int8ul))),
-		"coef" / Array(1584, Int8ul),
+		"coef" / U8Array(1584),
 		"skip" / Array(3, Int8ul),
 		"inter_mode" / Array(7, (Array(3, Int8ul))),
 		"switchable_interp" / Array(4, (Array(2, Int8ul))),
@@ -62,24 +62,18 @@ class AVDVP9Probs(ProbsConstructClass):
 	def __init__(self):
 		super().__init__()
 
+	# packed coef order skips m >= 3 for l == 0 (dc only has 3 pt)
+	_coef_mask = np.ones((4, 2, 2, 6, 6, 3), dtype=bool)
+	_coef_mask[:, :, :, 0, 3:, :] = False
+
 	def _post_parse(self, obj):
-		count = 0
 		for key in list(obj):
 			if (key.startswith("_") or key in ["padding", "coef"]): continue
 			if (key in ["mv_fp", "mv_hp", "mv_comp"]): continue
 			obj[key] = np.array(obj[key])
 
 		coef = np.zeros((4, 2, 2, 6, 6, 3), dtype=np.uint8)
-		for i in range(4):
-			for j in range(2):
-				for k in range(2):
-					for l in range(6):
-						for m in range(6):
-							if (m >= 3 and l == 0): # dc only has 3 pt
-				                                break
-							for n in range(3):
-								coef[i][j][k][l][m][n] = obj["coef"][count]
-								count += 1
+		coef[self._coef_mask] = obj["coef"]
 		obj["coef"] = coef
 
 		mv_comps = []
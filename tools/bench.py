@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright 2023 Eileen Yoon <eyn@gmx.com>
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import subprocess
+import time
+import traceback
+import numpy as np
+from tools.common import ffprobe, get_decoder, hl, ANSI_GREEN, ANSI_RED
+
+DATA_DIR = pathlib.Path(__file__).resolve().parents[1] / "data"
+SYNTH_DIR = pathlib.Path(os.path.expanduser("~/.cache/avd/bench"))
+SYNTH_CODECS = {  # codec -> (ffmpeg encoder, ext)
+	"h264": ("libx264", ".h264"),
+	"h265": ("libx265", ".h265"),
+	"vp09": ("libvpx-vp9", ".ivf"),
+}
+
+# Whole-stream stages run once; the rest are timed per frame. parse_other is
+# what parser.parse() spends outside the C lib and parse_headers: slice
+# assembly and SPS/PPS bookkeeping
+STREAM_STAGES = ["c_parse", "parse_headers", "parse_other"]
+FRAME_STAGES = ["init_slice", "hal_decode", "make_ffp", "finish_slice", "emu_decode"]
+
+def timed(times, fn):
+	def wrapper(*args, **kwargs):
+		t = time.perf_counter()
+		ret = fn(*args, **kwargs)
+		times.append(time.perf_counter() - t)
+		return ret
+	return wrapper
+
+def bench_stream(path, num, firmware):
+	mode = ffprobe(path)
+	dec = get_decoder(mode)()
+	dec.stfu = True
+	dec.hal.stfu = True
+	times = {stage: [] for stage in STREAM_STAGES + FRAME_STAGES + ["parse"]}
+
+	# Instance attributes shadow the methods, so the library stays untouched
+	dec.parser.parse = timed(times["parse"], dec.parser.parse)
+	if (hasattr(dec.parser, "parse_payloads")):
+		dec.parser.parse_payloads = timed(times["c_parse"], dec.parser.parse_payloads)
+	else:  # VP9 runs libvp9 inline in parse()
+		dec.parser.lib.libvp9_decode = timed(times["c_parse"], dec.parser.lib.libvp9_decode)
+	dec.parser.parse_headers = timed(times["parse_headers"], dec.parser.parse_headers)
+	dec.init_slice = timed(times["init_slice"], dec.init_slice)
+	dec.finish_slice = timed(times["finish_slice"], dec.finish_slice)
+	dec.hal.decode = timed(times["hal_decode"], dec.hal.decode)
+	dec.make_ffp = timed(times["make_ffp"], dec.make_ffp)
+
+	slices = dec.setup(path, num=num)
+	if (num):
+		slices = slices[:num]
+	times["parse_other"] = [times["parse"][0] - sum(times["c_parse"]) - sum(times["parse_headers"])]
+	del times["parse"]
+
+	emu = None
+	if (firmware):
+		from avd_emu import AVDEmulator
+		emu = AVDEmulator(firmware, stfu=True, fast=True)
+		emu.boot()
+
+	for sl in slices:
+		dec.decode(sl)
+		if (emu):
+			buf = dec.build_fp()
+			t = time.perf_counter()
+			emu.avd_cm3_cmd_decode("<bench>", buf)
+			times["emu_decode"].append(time.perf_counter() - t)
+
+	frames = len(slices)
+	stages = {}
+	for stage, x in times.items():
+		if (not x): continue
+		x = np.array(x) * 1e3
+		total = x.sum()
+		ent = {"total_ms": float(total), "per_frame_ms": float(total / frames), "frames_per_s": float(frames / total * 1e3) if total else 0.0}
+		if (stage in FRAME_STAGES):
+			ent.update({"p50_ms": float(np.percentile(x, 50)), "p90_ms": float(np.percentile(x, 90)),
+				"p99_ms": float(np.percentile(x, 99)), "max_ms": float(x.max())})
+		stages[stage] = ent
+	return {"stream": os.path.basename(path), "codec": mode, "resolution": "%dx%d" % (dec.ctx.width, dec.ctx.height),
+		"frames": frames, "stages": stages,
+		"peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def _child(q, path, num, firmware):
+	try:
+		q.put((bench_stream(path, num, firmware), None))
+	except BaseException:
+		q.put((None, traceback.format_exc()))
+
+def bench_isolated(path, num, firmware):
+	# Fresh process per stream so peak RSS is the stream's own
+	ctx = multiprocessing.get_context("fork")
+	q = ctx.Queue()
+	p = ctx.Process(target=_child, args=(q, path, num, firmware))
+	p.start()
+	while True:
+		try:
+			res, err = q.get(timeout=1)
+			break
+		except queue.Empty:
+			if (p.is_alive()): continue
+			try:
+				res, err = q.get(timeout=1)  # exited right after putting it
+				break
+			except queue.Empty:
+				raise RuntimeError("bench of %s died (exit code %s)" % (path, p.exitcode)) from None
+	p.join()
+	if (err):
+		raise RuntimeError("bench of %s failed:\n%s" % (path, err.rstrip()))
+	return res
+
+def synth_streams(codecs, sizes, frames, ffmpeg):
+	# Deterministic testsrc streams, encoded once and cached
+	if (not shutil.which(ffmpeg)):
+		raise RuntimeError("--synth needs ffmpeg (%s) with %s" % (ffmpeg, ", ".join([SYNTH_CODECS[x][0] for x in codecs])))
+	SYNTH_DIR.mkdir(parents=True, exist_ok=True)
+	paths = []
+	for codec in codecs:
+		enc, ext = SYNTH_CODECS[codec]
+		for size in sizes:
+			path = SYNTH_DIR / ("testsrc_%s_%d%s" % (size, frames, ext))
+			if (not path.exists()):
+				cmd = [ffmpeg, "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc=size=%s:rate=30" % (size),
+					"-frames:v", str(frames), "-c:v", enc, "-pix_fmt", "yuv420p", "-g", "8"]
+				if (codec == "h264"):
+					cmd += ["-bf", "2"]
+				if (codec == "h265"):
+					cmd += ["-x265-params", "log-level=error"]
+				subprocess.run(cmd + [str(path)], check=True)
+			paths.append(str(path))
+	return paths
+
+def find_streams(codecs):
+	exts = {"h264": [".h264", ".264"], "h265": [".h265", ".265"], "vp09": [".ivf"]}
+	dirs = {"h264": "h264", "h265": "h265", "vp09": "vp9"}
+	paths = []
+	for codec in codecs:
+		root = DATA_DIR / dirs[codec]
+		if (not root.is_dir()): continue
+		paths += sorted([str(root / x) for x in os.listdir(root) if os.path.splitext(x)[1] in exts[codec]])
+	return paths
+
+def get_key(res):
+	return "%s/%s/%s" % (res["codec"], res["resolution"], res["stream"])
+
+def compare(results, baseline, threshold, stage_thresholds):
+	# Regression if per-frame time grew by more than the stage's threshold
+	regressions = []
+	base = {get_key(res): res for res in baseline["results"] if "error" not in res}
+	for res in results:
+		key = get_key(res)
+		if (key not in base): continue
+		for stage, ent in res["stages"].items():
+			ref = base[key]["stages"].get(stage)
+			if ((ref is None) or (not ref["per_frame_ms"])): continue
+			ratio = ent["per_frame_ms"] / ref["per_frame_ms"]
+			limit = stage_thresholds.get(stage, threshold)
+			ent["baseline_ratio"] = ratio
+			if (ratio > 1 + limit):
+				regressions.append((key, stage, ratio, limit))
+	return regressions
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(prog='Per-stage decoder benchmark')
+	parser.add_argument('streams', nargs='*', type=str, help="bitstreams (default: everything under data/)")
+	parser.add_argument('-c', '--codecs', type=str, nargs='+', default=list(SYNTH_CODECS), choices=list(SYNTH_CODECS))
+	parser.add_argument('-n', '--num', type=int, default=0, help="frames per stream (0 for all)")
+	parser.add_argument('-s', '--synth', type=str, nargs='*', default=None, help="benchmark synthetic WxH testsrc streams instead")
+	parser.add_argument('--synth-frames', type=int, default=30, help="frames per synthetic stream")
+	parser.add_argument('--ffmpeg', type=str, default="ffmpeg", help="ffmpeg for --synth")
+	parser.add_argument('-f', '--firmware', type=str, default="", help="also time emulator decode with this firmware")
+	parser.add_argument('-o', '--output', type=str, default="", help="write JSON results here")
+	parser.add_argument('-b', '--baseline', type=str, default="", help="compare against this results JSON")
+	parser.add_argument('-t', '--threshold', type=float, default=0.10, help="allowed per-frame slowdown vs baseline")
+	parser.add_argument('-T', '--stage-threshold', type=str, action='append', default=[], help="per-stage override, e.g. hal_decode=0.2")
+	args = parser.parse_args()
+
+	if (args.synth is not None):
+		paths = synth_streams(args.codecs, args.synth or ["320x240", "1280x720", "1920x1080"], args.synth_frames, args.ffmpeg)
+	elif (args.streams):
+		paths = args.streams
+	else:
+		paths = find_streams(args.codecs)
+	if (not paths):
+		print("no streams: pass paths, put some under data/ or use --synth")
+		sys.exit(1)
+
+	results = []
+	for path in paths:
+		res = bench_isolated(path, args.num, args.firmware)
+		results.append(res)
+		print("%s %s %s: %d frames, peak RSS %.1f MiB" % (res["codec"], res["resolution"], res["stream"],
+			res["frames"], res["peak_rss_kb"] / 1024))
+		for stage in STREAM_STAGES + FRAME_STAGES:
+			ent = res["stages"].get(stage)
+			if (not ent): continue
+			s = "  %-14s %9.3f ms/frame %9.1f frames/s" % (stage, ent["per_frame_ms"], ent["frames_per_s"])
+			if ("p50_ms" in ent):
+				s += "  p50 %.3f p90 %.3f p99 %.3f ms" % (ent["p50_ms"], ent["p90_ms"], ent["p99_ms"])
+			print(s)
+
+	regressions = []
+	if (args.baseline):
+		stage_thresholds = {k: float(v) for k, v in [x.split("=", 1) for x in args.stage_threshold]}
+		regressions = compare(results, json.load(open(args.baseline)), args.threshold, stage_thresholds)
+		for key, stage, ratio, limit in regressions:
+			print(hl("REGRESSION %s %s: %.2fx baseline (limit %.2fx)" % (key, stage, ratio, 1 + limit), ANSI_RED))
+		if (not regressions):
+			print(hl("no regressions vs %s" % (args.baseline), ANSI_GREEN))
+
+	if (args.output):
+		with open(args.output, "w") as f:
+			json.dump({"time": time.time(), "results": results}, f, indent=1)
+	sys.exit(1 if regressions else 0)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright 2023 Eileen Yoon <eyn@gmx.com>
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+
+import argparse
+import os
+import time
+from avd_emu import AVDEmulator
+from tools.common import resolve_input
+
+def run(firmware, paths, fast):
+	emu = AVDEmulator(firmware, stfu=True, fast=fast)
+	emu.start()
+	streams = []
+	t = time.perf_counter()
+	for path in paths:
+		streams.append(list(emu.avd_cm3_cmd_decode(path)))
+	return time.perf_counter() - t, streams
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(prog='Time firmware emulation with and without --fast')
+	parser.add_argument('-f', '--firmware', type=str, required=True, help="path to firmware")
+	parser.add_argument('-d', '--dir', type=str, required=True, help="frame_params trace directory")
+	parser.add_argument('-n', '--num', type=int, default=0, help="count (0 for all)")
+	parser.add_argument('-r', '--repeat', type=int, default=3, help="best of")
+	args = parser.parse_args()
+
+	dirname = resolve_input(args.dir, isdir=True)
+	paths = sorted([os.path.join(dirname, path) for path in os.listdir(dirname) if "frame" in path])
+	if (args.num):
+		paths = paths[:args.num]
+	assert(len(paths))
+
+	res = {}
+	for fast in [False, True]:
+		best = None
+		for n in range(args.repeat):
+			elapsed, streams = run(args.firmware, paths, fast)
+			if ((best == None) or (elapsed < best[0])):
+				best = (elapsed, streams)
+		res[fast] = best
+
+	assert(res[False][1] == res[True][1])  # same inst stream
+	for fast in [False, True]:
+		elapsed = res[fast][0]
+		print("%-8s %4d frames  %8.1f frames/s" % ("fast" if fast else "baseline", len(paths), len(paths) / elapsed))
+	print("speedup: %.2fx" % (res[False][0] / res[True][0]))
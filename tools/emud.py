@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright 2023 Eileen Yoon <eyn@gmx.com>
+#
+# Persistent emulator daemon: keeps a pool of warm emulators per firmware
+# image and serves frame_params -> inst stream over a Unix socket.
+#
+# Request:  <III op, len(firmware path), len(payload)> firmware path, payload
+# Response: <II status, len(body)> body
+#   EMUD_OP_DECODE: payload is frame_params, body is the inst stream as <u32 words
+#   EMUD_OP_STATS:  body is JSON request/latency stats
+# A non-zero status carries an error message as the body. Requests over
+# EMUD_MAX_PATH/EMUD_MAX_PAYLOAD get an error and the connection is closed.
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+
+import argparse
+import collections
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+from array import array
+
+EMUD_OP_DECODE = 0
+EMUD_OP_STATS  = 1
+EMUD_SOCKET = "/tmp/avd_emud.sock"
+EMUD_MAX_PATH = 4096
+EMUD_MAX_PAYLOAD = 16 << 20  # VP9 frame_params are ~0.7 MiB
+
+def recv_exact(sock, size):
+	buf = bytearray(size)
+	view = memoryview(buf)
+	while (size):
+		n = sock.recv_into(view, size)
+		if (not n):
+			raise EOFError("socket closed")
+		view = view[n:]
+		size -= n
+	return bytes(buf)
+
+class AVDEmuServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+	def __init__(self, path, jobs=0, **kwargs):
+		if (os.path.exists(path)):
+			os.unlink(path)
+		super().__init__(path, AVDEmuHandler)
+		self.jobs = jobs
+		self.kwargs = kwargs
+		self.pools = {}
+		self.pool_locks = {}
+		self.lock = threading.Lock()  # stats and the dicts above, never held while booting
+		self.latency = collections.deque(maxlen=100000)
+		self.count = 0
+		self.errors = 0
+
+	def get_pool(self, firmware):
+		from avd_emu import AVDEmulatorPool
+		with self.lock:
+			pool = self.pools.get(firmware)
+			if (pool is not None):
+				return pool
+			pool_lock = self.pool_locks.setdefault(firmware, threading.Lock())
+		# Booting takes a while; only requests for this firmware wait on it
+		with pool_lock:
+			with self.lock:
+				pool = self.pools.get(firmware)
+			if (pool is None):
+				pool = AVDEmulatorPool(firmware, self.jobs, **self.kwargs)
+				with self.lock:
+					self.pools[firmware] = pool
+		return pool
+
+	def get_stats(self):
+		with self.lock:
+			lat = np.array(self.latency, dtype=np.float64) * 1e3
+			stats = {"requests": self.count, "errors": self.errors, "pools": list(self.pools)}
+		if (len(lat)):
+			for p in [50, 90, 99]:
+				stats["p%d_ms" % (p)] = float(np.percentile(lat, p))
+			stats["max_ms"] = float(lat.max())
+		return stats
+
+	def server_close(self):
+		super().server_close()
+		with self.lock:
+			pools = list(self.pools.values())
+		for pool in pools:
+			pool.close()
+		if (os.path.exists(self.server_address)):
+			os.unlink(self.server_address)
+
+class AVDEmuHandler(socketserver.BaseRequestHandler):
+	def handle(self):
+		server = self.server
+		sock = self.request
+		while True:
+			try:
+				op, fwlen, size = struct.unpack("<III", recv_exact(sock, 12))
+				if ((fwlen > EMUD_MAX_PATH) or (size > EMUD_MAX_PAYLOAD)):
+					body = ("request too large (path %d, payload %d bytes)" % (fwlen, size)).encode()
+					sock.sendall(struct.pack("<II", 1, len(body)) + body)
+					with server.lock:
+						server.errors += 1
+					return
+				firmware = recv_exact(sock, fwlen).decode()
+				payload = recv_exact(sock, size)
+			except EOFError:
+				return
+			t = time.perf_counter()
+			status = 0
+			try:
+				if (op == EMUD_OP_DECODE):
+					body = server.get_pool(firmware).decode(payload)
+				elif (op == EMUD_OP_STATS):
+					body = json.dumps(server.get_stats()).encode()
+				else:
+					raise ValueError("bad op %d" % (op))
+			except Exception as e:
+				status = 1
+				body = ("%s: %s" % (type(e).__name__, e)).encode()
+			if (op == EMUD_OP_DECODE):
+				with server.lock:
+					server.latency.append(time.perf_counter() - t)
+					server.count += 1
+					server.errors += status
+			sock.sendall(struct.pack("<II", status, len(body)) + body)
+
+class AVDEmuClient:
+	def __init__(self, path=EMUD_SOCKET):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.connect(path)
+
+	def request(self, op, firmware, payload):
+		firmware = os.path.abspath(firmware).encode() if firmware else b""
+		self.sock.sendall(struct.pack("<III", op, len(firmware), len(payload)) + firmware + payload)
+		status, size = struct.unpack("<II", recv_exact(self.sock, 8))
+		body = recv_exact(self.sock, size)
+		if (status):
+			raise RuntimeError(body.decode())
+		return body
+
+	def decode(self, firmware, frame_params):
+		return array('I', self.request(EMUD_OP_DECODE, firmware, frame_params))
+
+	def stats(self):
+		return json.loads(self.request(EMUD_OP_STATS, "", b""))
+
+	def close(self):
+		self.sock.close()
+
+	def __enter__(self): return self
+	def __exit__(self, *args): self.close()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(prog='AVD emulator daemon')
+	parser.add_argument('-s', '--socket', type=str, default=EMUD_SOCKET, help="unix socket path")
+	sub = parser.add_subparsers(dest="cmd", required=True)
+	p = sub.add_parser("serve", help="run the daemon")
+	p.add_argument('-j', '--jobs', type=int, default=0, help="workers per firmware (0 for all cores)")
+	p = sub.add_parser("decode", help="emulate frame_params files through the daemon")
+	p.add_argument('-f', '--firmware', type=str, required=True, help="path to firmware")
+	p.add_argument('paths', nargs='+', type=str, help="frame_params files")
+	p = sub.add_parser("stats", help="show daemon request/latency stats")
+	args = parser.parse_args()
+
+	if (args.cmd == "serve"):
+		with AVDEmuServer(args.socket, args.jobs) as server:
+			print("listening on %s" % (args.socket))
+			try:
+				server.serve_forever()
+			except KeyboardInterrupt:
+				pass
+			print(json.dumps(server.get_stats()))
+	elif (args.cmd == "decode"):
+		with AVDEmuClient(args.socket) as client:
+			for path in args.paths:
+				inst = client.decode(args.firmware, open(path, "rb").read())
+				print("%s: %d words" % (path, len(inst)))
+	elif (args.cmd == "stats"):
+		with AVDEmuClient(args.socket) as client:
+			print(json.dumps(client.stats(), indent=1))
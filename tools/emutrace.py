@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright 2023 Eileen Yoon <eyn@gmx.com>
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+
+import argparse
+import numpy as np
+from avd_emu import AVDTraceRing
+
+def parse_range(s):
+	lo, _, hi = s.partition(":")
+	lo = int(lo, 16)
+	hi = int(hi, 16) if hi else lo + 1
+	return lo, hi
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(prog='Query avd_emu.py -R ring buffer dumps')
+	parser.add_argument('input', type=str, help="path to trace.npy")
+	parser.add_argument('-a', '--addr', type=str, action='append', default=[], help="hex address range lo:hi (repeatable)")
+	parser.add_argument('-p', '--pc', type=str, action='append', default=[], help="hex PC range lo:hi (repeatable)")
+	parser.add_argument('-c', '--cmd', type=int, action='append', default=[], help="command index (repeatable)")
+	parser.add_argument('-r', '--reads', action='store_true', help="reads only")
+	parser.add_argument('-w', '--writes', action='store_true', help="writes only")
+	parser.add_argument('-s', '--summary', action='store_true', help="access counts per address")
+	parser.add_argument('-n', '--num', type=int, default=0, help="print at most N records (0 for all)")
+	args = parser.parse_args()
+
+	rec = AVDTraceRing.load(args.input)
+	mask = np.ones(len(rec), dtype=bool)
+	for key, ranges in [("addr", args.addr), ("pc", args.pc)]:
+		if (not ranges): continue
+		m = np.zeros(len(rec), dtype=bool)
+		for (lo, hi) in map(parse_range, ranges):
+			m |= (rec[key] >= lo) & (rec[key] < hi)
+		mask &= m
+	if (args.cmd):
+		mask &= np.isin(rec["cmd"], args.cmd)
+	if (args.reads):
+		mask &= rec["write"] == 0
+	if (args.writes):
+		mask &= rec["write"] == 1
+	rec = rec[mask]
+
+	if (args.summary):
+		for write in [0, 1]:
+			addrs, counts = np.unique(rec["addr"][rec["write"] == write], return_counts=True)
+			order = np.argsort(-counts, kind="stable")
+			print("%s: %d accesses, %d addresses" % ("writes" if write else "reads", counts.sum(), len(addrs)))
+			for addr, count in zip(addrs[order], counts[order]):
+				print("  %08x: %d" % (addr, count))
+		sys.exit(0)
+
+	if (args.num):
+		rec = rec[:args.num]
+	for x in rec:
+		print("[%3d] %04x: %s%-2d @ %08x val 0x%x" % (x["cmd"], x["pc"], "W" if x["write"] else "R",
+			x["size"] * 8, x["addr"], x["val"]))
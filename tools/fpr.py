@@ -19,6 +19,7 @@ if __name__ == "__main__":
 	parser.add_argument('-n', '--num', type=int, default=1, help="count from start")
 	parser.add_argument('-a', '--all', action='store_true', help="run all")
 	parser.add_argument('--decimal', action='store_true', help="run all")
+	parser.add_argument('-q', '--quiet', action='store_true', help="don't print the parsed fp")
 	args = parser.parse_args()
 
 	if (not args.decimal):
@@ -41,9 +42,9 @@ if __name__ == "__main__":
 	out = []
 	for i,path in enumerate(paths):
 		print(i, path)
-		params = open(path, "rb").read()
-		fp = fpcls.parse(params)
-		print(fp)
+		fp = fpcls.fromfile(path)
+		if (not args.quiet):
+			print(fpcls.parse(open(path, "rb").read()))
 
 		#x = addrs.index(fp.hdr.hdr_138_ref_rvra0_addr_lsb7[0])
 		#x = addrs2.index(fp.hdr.hdr_150_ref_rvra2_addr_lsb7[0])
@@ -57,7 +58,7 @@ if __name__ == "__main__":
 			x = fp.slc.slc_bd4_sps_tile_addr2_lsb8
 			if (x) not in addrs:
 				addrs.append(x)
-			y = fp.hdr.
+			y = fp.hdr.hdr_dc_pps_tile_addr_lsb8[0]
 			z = addrs.index(x)
 			out.append((i, y, z))
 
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright 2023 Eileen Yoon <eyn@gmx.com>
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+
+import argparse
+import time
+from tools.common import ffprobe, resolve_input, get_decoder
+
+def run(path, mode, num, use_templates):
+	dec = get_decoder(mode)()
+	dec.stfu = True
+	dec.hal.stfu = True
+	dec.hal.use_templates = use_templates
+	units = dec.setup(path, num=num, nal_stop=1)
+
+	hal_decode = dec.hal.decode
+	times = []
+	def timed_decode(ctx, sl):
+		t = time.perf_counter()
+		inst_stream = hal_decode(ctx, sl)
+		times.append(time.perf_counter() - t)
+		return inst_stream
+	dec.hal.decode = timed_decode
+
+	if (num):
+		units = units[:num]
+	streams = [dec.decode(unit).tobytes() for unit in units]
+	return times, streams
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(prog='Time per-frame HAL instruction generation')
+	parser.add_argument('input', type=str, help="path to bitstream")
+	parser.add_argument('-n', '--num', type=int, default=0, help="count (0 for all)")
+	parser.add_argument('-r', '--repeat', type=int, default=5, help="best of")
+	args = parser.parse_args()
+
+	path = resolve_input(args.input)
+	mode = ffprobe(path)
+	if (mode not in ["h264", "h265"]):
+		raise ValueError("Codec %s has no HAL templates" % mode)
+
+	res = {}
+	for use_templates in [False, True]:
+		best = None
+		for n in range(args.repeat):
+			times, streams = run(path, mode, args.num, use_templates)
+			if ((best == None) or (sum(times) < sum(best[0]))):
+				best = (times, streams)
+		res[use_templates] = best
+
+	assert(res[False][1] == res[True][1])  # bit-identical
+	for use_templates in [False, True]:
+		times = res[use_templates][0]
+		print("%-9s %4d frames  %8.1f us/frame  (first %.1f us)" % ("template" if use_templates else "baseline",
+			len(times), sum(times) / len(times) * 1e6, times[0] * 1e6))
+	print("speedup: %.2fx" % (sum(res[False][0]) / sum(res[True][0])))
@@ -63,10 +63,9 @@ if __name__ == "__main__":
             dec.init_slice()
             ctx = deepcopy(dec.ctx)
 
-        params = open(path, "rb").read()
-        fp = fpcls.parse(params)
+        fp = fpcls.fromfile(path)
         if (args.verbose):
-            print(fp)
+            print(fpcls.parse(open(path, "rb").read()))
 
         if 1:
             x = fp.hdr.hdr_bc_sps_tile_addr_lsb8
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright 2023 Eileen Yoon <eyn@gmx.com>
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tools.common import getext, hl, ANSI_GREEN, ANSI_RED
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+TEST_PY = str(ROOT_DIR / "tools" / "test.py")
+DATA_DIR = ROOT_DIR / "data"
+MANIFEST = pathlib.Path(os.path.expanduser("~/.cache/avd/regress.json"))
+
+# Code every shard depends on: all of avid/ outside the codec packages, which
+# are added per mode along with their libs
+COMMON_SOURCES = ["tools/test.py", "tools/common.py"]
+
+KINDS = {  # kind -> (test.py flag, modes it applies to, trace files it reads)
+	"fp":    ("-j", ["h264", "h265", "vp9"], "frame"),
+	"emu":   ("-e", ["h264", "h265", "vp9"], "frame"),
+	"probs": ("-q", ["vp9"], "probs"),
+}
+
+class FileHasher:
+	# sha256 per file, memoized on (size, mtime) so unchanged trace dirs are cheap.
+	# Keyed relative to the checkout so the manifest isn't tied to one path
+	def __init__(self, memo):
+		self.memo = memo
+
+	def hash(self, path):
+		key = os.path.relpath(path, ROOT_DIR)
+		if (not os.path.exists(path)):
+			return "missing"
+		st = os.stat(path)
+		sig = [st.st_size, st.st_mtime_ns]
+		ent = self.memo.get(key)
+		if (ent and ent[0] == sig):
+			return ent[1]
+		h = hashlib.sha256()
+		with open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(1 << 20), b""):
+				h.update(chunk)
+		self.memo[key] = [sig, h.hexdigest()]
+		return h.hexdigest()
+
+def get_inputs(job, args):
+	# Every file a shard's result depends on
+	mode, name, kind = job
+	root = DATA_DIR / mode
+	paths = sorted((ROOT_DIR / "avid").glob("*.py")) + [ROOT_DIR / x for x in COMMON_SOURCES]
+	paths += sorted((ROOT_DIR / "avid" / mode).glob("*.py"))
+	paths += [ROOT_DIR / "codecs" / ("lib%s.so" % (mode))]
+	paths += [root / (name + ext) for ext in getext(mode) if (root / (name + ext)).exists()]
+	paths += sorted([root / name / x for x in os.listdir(root / name) if KINDS[kind][2] in x])
+	if (kind == "emu"):
+		paths += [ROOT_DIR / "avd_emu.py", args.firmware]
+	return paths
+
+def get_job_hash(job, args, hasher):
+	h = hashlib.sha256()
+	for path in get_inputs(job, args):
+		h.update(os.path.relpath(path, ROOT_DIR).encode())
+		h.update(hasher.hash(path).encode())
+	return h.hexdigest()
+
+def discover(modes):
+	# (mode, dir) for every trace dir that has a matching bitstream next to it
+	out = []
+	for mode in modes:
+		root = DATA_DIR / mode
+		if (not root.is_dir()): continue
+		for name in sorted(os.listdir(root)):
+			if (not (root / name).is_dir()): continue
+			if (any([(root / (name + ext)).exists() for ext in getext(mode)])):
+				out.append((mode, name))
+	return out
+
+def get_jobs(dirs, kinds):
+	return [(mode, name, kind) for (mode, name) in dirs for kind in kinds if mode in KINDS[kind][1]]
+
+def run_job(job, args, cwd):
+	mode, name, kind = job
+	cmd = [sys.executable, TEST_PY, "-m", mode, "-d", name, "-a", "-x", KINDS[kind][0]]
+	if (kind == "emu"):
+		cmd += ["-f", args.firmware]
+	t = time.perf_counter()
+	try:
+		res = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+			timeout=args.timeout if args.timeout else None)
+		code, out = res.returncode, res.stdout
+	except subprocess.TimeoutExpired as e:
+		code, out = -1, (e.stdout or b"") + b"\ntimeout\n"
+	lines = out.decode(errors="replace").strip().splitlines()
+	return {"mode": mode, "dir": name, "kind": kind, "ok": code == 0, "returncode": code,
+		"time": time.perf_counter() - t, "tail": lines[-args.tail:] if code else []}
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(prog='Run tools/test.py over every trace dir in parallel')
+	parser.add_argument('-m', '--modes', type=str, nargs='+', default=["h264", "h265", "vp9"], help="codec dirs under data/")
+	parser.add_argument('-k', '--kinds', type=str, nargs='+', default=["fp", "probs"], choices=list(KINDS), help="tests to run")
+	parser.add_argument('-d', '--dirs', type=str, nargs='+', default=[], help="only these trace dirs")
+	parser.add_argument('-f', '--firmware', type=str, default="j293ap-13.5-viola-firmware.bin", help="firmware for emu")
+	parser.add_argument('-J', '--jobs', type=int, default=0, help="parallel shards (0 for all cores)")
+	parser.add_argument('-o', '--output', type=str, default="", help="also append JSON lines here")
+	parser.add_argument('-t', '--timeout', type=int, default=0, help="per-shard timeout in seconds (0 for none)")
+	parser.add_argument('--tail', type=int, default=20, help="output lines kept from failed shards")
+	parser.add_argument('-M', '--manifest', type=str, default=str(MANIFEST), help="input hash manifest path")
+	parser.add_argument('-F', '--force', action='store_true', help="rerun shards with unchanged inputs")
+	args = parser.parse_args()
+	args.firmware = os.path.abspath(args.firmware)
+
+	dirs = discover(args.modes)
+	if (args.dirs):
+		dirs = [(mode, name) for (mode, name) in dirs if name in args.dirs]
+	jobs = get_jobs(dirs, args.kinds)
+	if (not jobs):
+		print("no trace dirs found under %s" % (DATA_DIR))
+		sys.exit(1)
+
+	manifest = {"files": {}, "shards": {}}
+	if (os.path.exists(args.manifest)):
+		manifest = json.load(open(args.manifest))
+	hasher = FileHasher(manifest["files"])
+	results = []
+	todo = []
+	hashes = {}
+	for job in jobs:
+		key = "/".join(job)
+		hashes[key] = get_job_hash(job, args, hasher)
+		prev = manifest["shards"].get(key)
+		if ((not args.force) and prev and prev["hash"] == hashes[key] and prev["result"]["ok"]):
+			res = dict(prev["result"], cached=True)
+			results.append(res)
+			print(json.dumps(res), flush=True)
+		else:
+			todo.append(job)
+
+	# test.py resolves relative dir names against data/ only if they don't
+	# exist under the cwd, so run the shards from an empty dir
+	cwd = tempfile.mkdtemp(prefix="avd_regress")
+	out = open(args.output, "a") if args.output else None
+	t = time.perf_counter()
+	with ThreadPoolExecutor(args.jobs if args.jobs else os.cpu_count()) as pool:
+		futures = [pool.submit(run_job, job, args, cwd) for job in todo]
+		for future in as_completed(futures):
+			res = future.result()
+			results.append(res)
+			key = "/".join([res["mode"], res["dir"], res["kind"]])
+			# Only passes are reused; failures and timeouts may be down to the
+			# environment (missing firmware, a loaded box) and always rerun
+			if (res["ok"]):
+				manifest["shards"][key] = {"hash": hashes[key], "result": res}
+			else:
+				manifest["shards"].pop(key, None)
+			line = json.dumps(res)
+			print(line, flush=True)
+			if (out):
+				out.write(line + "\n")
+				out.flush()
+	elapsed = time.perf_counter() - t
+	os.rmdir(cwd)
+	if (out):
+		out.close()
+	os.makedirs(os.path.dirname(os.path.abspath(args.manifest)), exist_ok=True)
+	with open(args.manifest + ".tmp", "w") as f:
+		json.dump(manifest, f)
+	os.replace(args.manifest + ".tmp", args.manifest)
+
+	results.sort(key=lambda x: (x["mode"], x["dir"], x["kind"]))
+	print()
+	print("%-6s %-24s %-6s %-6s %8s" % ("mode", "dir", "kind", "result", "time"))
+	for res in results:
+		result = hl("PASS", ANSI_GREEN) if res["ok"] else hl("FAIL", ANSI_RED)
+		print("%-6s %-24s %-6s %s %7.1fs%s" % (res["mode"], res["dir"], res["kind"], result, res["time"],
+			" (cached)" if res.get("cached") else ""))
+	failed = len([res for res in results if not res["ok"]])
+	ran = [res for res in results if not res.get("cached")]
+	cpu = sum([res["time"] for res in ran])
+	print("\n%d shards (%d ran, %d unchanged), %d passed, %d failed in %.1fs wall (%.1fs total, %.1fx)" % (len(results),
+		len(ran), len(results) - len(ran), len(results) - failed, failed, elapsed, cpu, cpu / elapsed if elapsed else 0))
+	sys.exit(1 if failed else 0)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright 2023 Eileen Yoon <eyn@gmx.com>
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
+
+import argparse
+import numpy as np
+from avd_emu import AVD_CM3_SRAM_ADDR, AVD_CM3_SRAM_SIZE, AVD_CM3_CMD_DECODE, AVD_CM3_MODE_NAMES
+from tools.common import ffprobe, resolve_input, get_decoder
+
+def get_frame_types(path):
+	# One label per frame in decode order, same pairing as test.py
+	mode = ffprobe(path)
+	dec = get_decoder(mode)()
+	dec.stfu = True
+	dec.hal.stfu = True
+	slices = dec.setup(path, do_probs=0)
+	if (mode == "vp9"):
+		return ["K" if not sl.frame_type else "F" for sl in slices]
+	return [sl.get_slice_str(sl.slice_type) for sl in slices]
+
+def get_regions(words, gap):
+	# Merge changed word indices closer than gap words into [lo, hi) runs
+	idx = np.flatnonzero(words)
+	if (not len(idx)):
+		return np.zeros((0, 2), dtype=np.int64)
+	breaks = np.flatnonzero(np.diff(idx) > gap)
+	lo = np.concatenate(([idx[0]], idx[breaks + 1]))
+	hi = np.concatenate((idx[breaks], [idx[-1]])) + 1
+	return np.stack((lo, hi), axis=1)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(prog='Report SRAM regions changed per command from avd_emu.py -D')
+	parser.add_argument('input', type=str, help="path to sram deltas .npz")
+	parser.add_argument('-i', '--bitstream', type=str, default="", help="matching bitstream, to label frames by slice type")
+	parser.add_argument('-g', '--gap', type=int, default=1, help="merge changes up to N words apart")
+	parser.add_argument('-v', '--verbose', action='store_true', help="show old/new words per region and command")
+	args = parser.parse_args()
+
+	d = np.load(args.input)
+	start, off, old, new = d["start"], d["off"], d["old"], d["new"]
+	num = len(d["cmd"])
+
+	labels = []
+	types = get_frame_types(resolve_input(args.bitstream)) if args.bitstream else None
+	n = 0
+	for i in range(num):
+		if (d["opcode"][i] != AVD_CM3_CMD_DECODE):
+			labels.append("cmd_%d" % (d["opcode"][i]))
+			continue
+		label = AVD_CM3_MODE_NAMES.get(int(d["mode"][i]), "?")
+		if (types is not None):
+			label += ":" + (types[n] if n < len(types) else "?")
+		labels.append(label)
+		n += 1
+
+	words = np.zeros(AVD_CM3_SRAM_SIZE // 4, dtype=bool)
+	words[off // 4] = True
+	regions = get_regions(words, args.gap)
+	region_of = np.full(AVD_CM3_SRAM_SIZE // 4, -1, dtype=np.int64)
+	for r, (lo, hi) in enumerate(regions):
+		region_of[lo:hi] = r
+
+	names = sorted(set(labels))
+	totals = {name: labels.count(name) for name in names}
+	hits = {name: np.zeros(len(regions), dtype=np.int64) for name in names}
+	for i in range(num):
+		touched = np.unique(region_of[off[start[i]:start[i+1]] // 4])
+		hits[labels[i]][touched] += 1
+
+	print("%d commands, %d changed words, %d regions" % (num, words.sum(), len(regions)))
+	print("commands: " + ", ".join(["%s %d" % (name, totals[name]) for name in names]))
+	for r, (lo, hi) in enumerate(regions):
+		s = "%08x-%08x (%4d words):" % (AVD_CM3_SRAM_ADDR + lo * 4, AVD_CM3_SRAM_ADDR + hi * 4, hi - lo)
+		for name in names:
+			if (hits[name][r]):
+				s += " %s %d/%d" % (name, hits[name][r], totals[name])
+		print(s)
+		if (args.verbose):
+			for i in range(num):
+				sl = slice(start[i], start[i+1])
+				m = (off[sl] >= lo * 4) & (off[sl] < hi * 4)
+				for o, x0, x1 in zip(off[sl][m], old[sl][m], new[sl][m]):
+					print("  [%3d %s] %08x: %08x -> %08x" % (d["cmd"][i], labels[i], AVD_CM3_SRAM_ADDR + o, x0, x1))
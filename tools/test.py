@@ -5,6 +5,8 @@ import sys, pathlib
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 
 import argparse
+import json
+import numpy as np
 import os
 
 from avid.fp import *
@@ -21,6 +23,8 @@ class AVDUnitTest:
 		self.dec.stfu = True
 		self.dec.hal.stfu = True
 		self.fp_keys = []
+		self.fp_mask = None
+		self.emu_summary = []
 		self.pr_keys = []
 		self.emu_ignore_keys = []
 		self.args = dotdict(kwargs)
@@ -28,37 +32,25 @@ class AVDUnitTest:
 			self.dec.stfu = False
 			if (self.args.verbose):
 				self.dec.hal.stfu = False
+		if (self.args.stats):
+			self.dec.enable_stats(self.args.stats, self.args.stats_interval)
+		if (self.args.trace):
+			self.dec.enable_trace(self.args.trace).meta("process_name", "test.py")
 
 	def log(self, x, verbose=False):
 		if ((not self.args.stfu) and ((not verbose) or (verbose and self.args.verbose))):
 			print(f"[{hl('TST', ANSI_CYAN)}] {x}")
 
-	def diff_fp_field(self, sl, x0, x1, name):
-		if (x1 == 0): return # they fill out N/A fields
-		if (x0 != x1) and (not (self.args.debug_mode)):
-			print(sl)
-		cassert(x0, x1, name, fatal=not self.args.non_fatal)
-
 	def diff_fp(self, sl, fp0, fp1, args):
-		for cand in self.fp_keys:
-			if (not isinstance(cand, str)):
-				name, count = cand
-			else:
-				name, count = cand, None
-			x0 = getattr(getattr(fp0, name[:3]), name)
-			if (not (hasattr(fp1, name))):
-				if (isinstance(x0, ListContainer)):
-					x1 = [0] * len(x0)
-				else:
-					x1 = 0
-			else:
-				x1 = fp1[name]
-			if (isinstance(x0, ListContainer)):
-				num = len(x0) if not count else count
-				for n in range(num):
-					self.diff_fp_field(sl, x0[n], x1[n],  "%s[%d]" % (name, n))
-			else:
-				self.diff_fp_field(sl, x0, x1,  name)
+		# fp0, fp1: raw trace and generated blobs, compared on fp_keys only
+		if (self.fp_mask == None):
+			self.fp_mask = self.dec.fpcls.get_word_mask(self.fp_keys)
+		bad = self.dec.fpcls.diff_words(fp0, fp1, self.fp_mask)
+		if (bad and not self.args.debug_mode):
+			print(sl)
+		for name, n, x0, x1 in bad:
+			cassert(x0, x1, name if n == None else "%s[%d]" % (name, n), fatal=not self.args.non_fatal)
+		return bad
 
 	def get_paths(self, ident, args):
 		paths = os.listdir(os.path.join(args.prefix, args.dir))
@@ -97,17 +89,22 @@ class AVDUnitTest:
 		paths, num = self.get_paths("frame", args)
 		slices = self.dec.setup(args.input, **vars(args))
 		self.init_hook()
+		fpsize = self.dec.fpcls.get_layout()["_size"]
 		count = 0
 		for i in range(num):
 			path = paths[i]
 			if (self.args.show_paths):
 				print(path)
-			fp0 = self.dec.fpcls.parse(open(path, "rb").read())
+			with open(path, "rb") as f:
+				fp0 = f.read(fpsize)
+			if (self.args.validate):
+				bad = self.dec.fpcls.validate(self.dec.fpcls.frombuffer(fp0))
+				assert(not bad), "%s failed validation: %s" % (path, ", ".join(bad))
 
 			sl = slices[i]
 			self.show_header(sl)
 			if (self.args.show_fp):
-				print(fp0)
+				print(self.dec.fpcls.parse(open(path, "rb").read()))
 
 			inst = self.dec.decode(sl)
 			if (self.args.debug_mode):
@@ -119,7 +116,11 @@ class AVDUnitTest:
 					else:
 						c = ANSI_RED
 					self.log(x.rep(clr=c))
-			fp1 = self.dec.ffp
+			fp1 = self.dec.build_fp()
+			if (self.args.validate):
+				# what AVDEmulator.set_params checks before taking the blob
+				from avd_emu import get_params_mode
+				get_params_mode(fp1)
 			res = self.diff_fp(sl, fp0, fp1, args)
 
 			if (self.args.debug_mode):
@@ -127,62 +128,94 @@ class AVDUnitTest:
 			count += 1
 		self.log(hl(f"Inst test '{args.dir}' ({count} frames) all good", ANSI_GREEN))
 
+	def show_emu_word(self, sl, n, x0, x1, name):
+		# x0: emulator word, x1: HAL word, None if past the end
+		s = ""
+		if (self.args.show_index):
+			s += f'[{hl(str(sl.idx).rjust(2), ANSI_CYAN)}]'
+		c = ANSI_GREEN if (x0 == x1) else ANSI_RED
+		s += f'[{hl(str(n).rjust(3), c)}] '
+
+		if (self.args.show_bits and x0 != None and x1 != None):
+			x0r = bitrepr32(x0)
+			x1r = bitrepr32(x1)
+			self.log(s + f'{bitrepr_diff(x0r, x1r)} | {name}')
+			return
+		x0r = f'{hex(x0 if x0 != None else 0xdeadbeef).rjust(2+8)}'
+		x1r = f'{hex(x1 if x1 != None else 0xdeadbeef).rjust(2+8)}'
+		if (x0 != x1):
+			x0r = hl(x0r, ANSI_RED)
+			if (x1 != None):
+				x1r = hl(x1r, ANSI_RED)
+		self.log(s + f'{x0r} | {x1r} | {name}')
+
 	def diff_emu(self, sl, inst0_stream, inst1_stream):
-		l0, l1 = len(inst0_stream), len(inst1_stream)
+		w0 = np.asarray(inst0_stream, dtype=np.uint32)
+		w1 = np.frombuffer(inst1_stream.vals, dtype=np.uint32)
+		l0, l1 = len(w0), len(w1)
 		num = min(l0, l1)
-		for n in range(num):
-			x0 = inst0_stream[n]
-			x1 = inst1_stream[n]
-			if ((not self.args.show_all) and (x0 == x1.val)): continue
-			if (not self.args.debug_mode and x1.name in self.emu_ignore_keys): continue
-
-			s = ""
-			if (self.args.show_index):
-				s += f'[{hl(str(sl.idx).rjust(2), ANSI_CYAN)}]'
-
-			if (x0 != x1.val):
-				c = ANSI_RED
-			else:
-				c = ANSI_GREEN
-			s += f'[{hl(str(n).rjust(3), c)}] '
-
-			if (self.args.show_bits):
-				x0r = bitrepr32(x0)
-				x1r = bitrepr32(x1.val)
-				diff = f'{bitrepr_diff(x0r, x1r)} | {x1.get_disp_name()}'
-				self.log(s + diff)
+
+		keep = np.ones(num, dtype=bool)
+		if (not self.args.debug_mode and self.emu_ignore_keys):
+			keep = ~inst1_stream.match_names(self.emu_ignore_keys)[:num]
+		if (self.args.show_all):
+			for n in np.flatnonzero(keep).tolist():
+				self.show_emu_word(sl, n, int(w0[n]), int(w1[n]), inst1_stream[n].get_disp_name())
+		diffs = np.flatnonzero((w0[:num] != w1[:num]) & keep)
+		diffs = np.concatenate((diffs, np.arange(num, max(l0, l1))))
+
+		shown = 0
+		for n in diffs.tolist():
+			x0 = int(w0[n]) if n < l0 else None
+			x1 = int(w1[n]) if n < l1 else None
+			name = inst1_stream.get_name(n) if n < l1 else ""
+			self.emu_summary.append({"frame": sl.idx, "index": n, "expected": x0, "actual": x1, "name": name})
+			if (self.args.show_all and n < num):
+				continue
+			if (self.args.max_diffs and shown >= self.args.max_diffs):
+				continue
+			self.show_emu_word(sl, n, x0, x1, inst1_stream[n].get_disp_name() if n < l1 else "")
+			shown += 1
+		if (len(diffs) > shown and not self.args.show_all):
+			self.log(f"... {len(diffs) - shown} more")
+		return len(diffs)
+
+	def get_emu_streams(self, paths):
+		# Emulate only what the cache doesn't have
+		from avd_emu import AVDEmulator, AVDEmulatorPool, AVDEmulatorCache
+		cache = None
+		if (self.args.emu_cache):
+			cache = AVDEmulatorCache(self.args.emu_cache, self.args.firmware, self.args.emu_cache_size << 20)
+		streams = [cache.get(path) if cache else None for path in paths]
+		misses = [paths[n] for n, x in enumerate(streams) if x is None]
+		if (misses and self.args.emu_jobs != 1):
+			with AVDEmulatorPool(self.args.firmware, self.args.emu_jobs, tracer=self.dec.tracer, fast=self.args.emu_fast) as pool:
+				insts = pool.map(misses)
+			self.log(f"Emulated {len(misses)} frames in {pool.elapsed:.2f} s ({len(misses) / pool.elapsed:.1f} frames/s)")
+		elif (misses):
+			emu = AVDEmulator(self.args.firmware, stfu=True, fast=self.args.emu_fast, tracer=self.dec.tracer)
+			if (self.args.emu_fast):
+				emu.boot()
 			else:
-				x0r = f'{hex(x0).rjust(2+8)}'
-				x1r = f'{hex(x1.val).rjust(2+8)}'
-				if (x0 != x1.val):
-					x0r = hl(x0r, ANSI_RED)
-					x1r = hl(x1r, ANSI_RED)
-				diff = f'{x0r} | {x1r} | {x1.get_disp_name()}'
-				self.log(s + diff)
-		if (l0 > l1):
-			for n in range(l0 - l1):
-				x0 = inst0_stream[n + l1]
-				x1 = 0xdeadbeef
-
-				s = ""
-				if (self.args.show_index):
-					s += f'[{hl(str(sl.idx).rjust(2), ANSI_CYAN)}]'
-				s += f'[{hl(str(n + l1).rjust(3), ANSI_RED)}] '
-				x0r = f'{hex(x0).rjust(2+8)}'
-				x1r = f'{hex(x1).rjust(2+8)}'
-				if (x0 != x1):
-					x0r = hl(x0r, ANSI_RED)
-					#x1r = hl(x1r, ANSI_RED)
-				diff = f'{x0r} | {x1r} | '
-				self.log(s + diff)
+				emu.start()
+			insts = [list(emu.avd_cm3_cmd_decode(path)) for path in misses]
+		if (misses):
+			insts = iter(insts)
+			for n in range(len(streams)):
+				if (streams[n] is None):
+					streams[n] = next(insts)
+					if (cache):
+						cache.put(paths[n], streams[n])
+		if (cache):
+			self.log(f"Emu cache: {cache.hits} hits, {cache.misses} misses")
+			cache.close()
+		return streams
 
 	def test_emu(self, args):
-		from avd_emu import AVDEmulator
 		#self.dec.hal.stfu = True
-		self.emu = AVDEmulator(args.firmware, stfu=True)
-		self.emu.start()
 		self.log(hl("Testing emu '%s'..." % (args.dir), None))
 		paths, num = self.get_paths("frame", args)
+		inst0_streams = self.get_emu_streams(paths[:num])
 		slices = self.dec.setup(args.input, do_probs=0, **vars(args))
 		self.init_hook()
 		count = 0
@@ -191,7 +224,7 @@ class AVDUnitTest:
 			if (self.args.show_paths):
 				print(path)
 			assert(os.path.isfile(path))
-			inst0_stream = self.emu.avd_cm3_cmd_decode(path)
+			inst0_stream = inst0_streams[i]
 
 			sl = slices[i]
 			self.show_header(sl)
@@ -201,6 +234,10 @@ class AVDUnitTest:
 			if (self.args.debug_mode):
 				print()
 			count += 1
+		if (self.args.summary):
+			with open(self.args.summary, "w") as f:
+				for x in self.emu_summary:
+					f.write(json.dumps(x) + "\n")
 		self.log(hl(f"Emu test '{args.dir}' ({count} frames) all good", ANSI_GREEN))
 
 class AVDH264UnitTest(AVDUnitTest):
@@ -396,12 +433,18 @@ class AVDVP9UnitTest(AVDUnitTest):
 			if (self.args.show_paths):
 				print(path)
 			assert(os.path.isfile(path))
-			x0 = open(paths[pidx], "rb").read()[:self.dec.probscls.sizeof()]
-			prx0 = self.dec.probscls.parse(x0)
+			with open(path, "rb") as f:
+				x0 = f.read(self.dec.probscls.sizeof())
 
 			sl = slices[i]
 			prx1 = sl.probs
 			x1 = sl.probs.to_avdprobs(prx1)
+			if (x0 == x1):
+				count += 1
+				continue
+
+			# only break it down per key on mismatch
+			prx0 = self.dec.probscls.parse(x0)
 			for key in self.pr_keys:
 				a = prx0[key]
 				b = prx1[key]
@@ -467,6 +510,10 @@ def test(args):
 	if (args.test_probs):
 		import numpy as np
 		ut.test_probs(args)
+	if (args.stats):
+		ut.dec.perf.dump()
+	if (args.trace):
+		ut.dec.tracer.save()
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(prog='Unit test')
@@ -485,6 +532,11 @@ if __name__ == "__main__":
 	parser.add_argument('-j', '--test-fp', action='store_true')
 	parser.add_argument('-e', '--test-emu', action='store_true')
 	parser.add_argument('-q', '--test-probs', action='store_true')
+	parser.add_argument('-ej', '--emu-jobs', type=int, default=1, help="emulate in N worker processes (0 for all cores)")
+	parser.add_argument('-ef', '--emu-fast', action='store_true', help="hook-minimal emulation, booted once and restored per frame")
+	parser.add_argument('-ec', '--emu-cache', type=str, default="", help="inst stream cache db path")
+	parser.add_argument('--emu-cache-size', type=int, default=1024, help="emu cache size limit in MiB")
+	parser.add_argument('--validate', action='store_true', help="run fp validators")
 
 	parser.add_argument('-u', '--debug-mode', action='store_true')
 	parser.add_argument('-b', '--show-bits', action='store_true')
@@ -495,6 +547,11 @@ if __name__ == "__main__":
 	parser.add_argument('-sh', '--show-headers', action='store_true')
 	parser.add_argument('-si', '--show-index', action='store_true')
 	parser.add_argument('-sp', '--show-paths', action='store_true')
+	parser.add_argument('-md', '--max-diffs', type=int, default=64, help="show at most N emu diffs per frame (0 for all)")
+	parser.add_argument('--summary', type=str, default="", help="write emu diffs as JSON lines")
+	parser.add_argument('--stats', type=str, default="", help="dump decoder stats here (.prom for Prometheus text, else JSON)")
+	parser.add_argument('--stats-interval', type=float, default=10.0, help="seconds between periodic stats dumps")
+	parser.add_argument('--trace', type=str, default="", help="write a Chrome trace-event JSON timeline here")
 	parser.add_argument('-sf', '--show-fp', action='store_true')
 	parser.add_argument('-ssp', '--show-sps', action='store_true')
 	parser.add_argument('-spp', '--show-pps', action='store_true')